@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+import numpy as np
+import sys, os, os.path
+import time, json, socket, resource, subprocess, tempfile, shutil, traceback
+from datetime import datetime
+
+
+bindir = os.path.dirname(os.path.abspath(__file__))
+
+# stage --> (target, arguments); target is a script of this package, run
+# as __main__, or 'loadh5:<func>'. {base}, {na}, ... are filled in by run()
+stages = [
+	('synth',	'mksynth.py',		['{base}', '-na', '{na}', '-nch', '{nch}', '-ndata', '{ndata}']),
+	('ldcorr',	'loadh5:ldcorr',	['{base}', '{na}']),
+	('convert',	'loadh5.py',		['{base}', '{na}']),
+	('ldoneh5',	'loadh5:ldoneh5',	['{base}.raw.oneh5']),
+	('calibrate',	'calibrate_oneh5.py',	['{base}.raw.oneh5', 'self']),
+	('sefd',	'track2sefd.py',	['{base}.raw.oneh5', '{base}_timing.txt', '100', '0.678']),
+	('pdf',		'plot_oneh5.py',	['{base}.raw.oneh5']),
+]
+
+
+def _procio():
+	# I/O counters of this process (Linux /proc/self/io), {} elsewhere
+	#	rchar/wchar		bytes passed to read()/write()
+	#	read_bytes/write_bytes	bytes fetched from/sent to storage
+	io = {}
+	try:
+		with open('/proc/self/io') as f:
+			for line in f:
+				(k, v) = line.split(':')
+				io[k.strip()] = int(v)
+	except IOError:
+		pass
+	return io
+
+
+def child(fjson, target, args):
+	# run one stage in this (child) process and save its cost to fjson:
+	# wall time, peak RSS and the I/O counters of the stage
+	sys.path.insert(0, bindir)
+	status = 'ok'
+	io0 = _procio()
+	t0 = time.time()
+	try:
+		if (target.startswith('loadh5:')):
+			import loadh5
+			func = getattr(loadh5, target.split(':')[1])
+			args = [int(a) if a.isdigit() else a for a in args]
+			func(*args)
+		else:
+			import runpy
+			sys.argv = [target] + args
+			runpy.run_path(os.path.join(bindir, target), run_name='__main__')
+	except SystemExit as e:
+		if (e.code not in [None, 0]):
+			status = 'exit %s' % e.code
+	except Exception as e:
+		traceback.print_exc()
+		status = 'error: %s' % repr(e)
+	wall = time.time() - t0
+	io1 = _procio()
+
+	res = {
+		'status':	status,
+		'wall':		wall,
+		'maxrss_mb':	resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+	}
+	for k in ['rchar', 'wchar', 'read_bytes', 'write_bytes']:
+		res[k] = (io1[k] - io0[k]) if (k in io1) else None
+	with open(fjson, 'w') as f:
+		json.dump(res, f)
+
+
+def _prepare(name, par, wdir):
+	# make the inputs of stage name that an earlier (skipped) stage
+	# would have made; not timed
+	base = os.path.join(wdir, par['base'])
+	if (name != 'synth' and not os.path.isfile(base + '.timestamp')):
+		import mksynth
+		mksynth.synth(base, par['na'], par['nch'], par['ndata'])
+	if (not name in ['synth', 'ldcorr', 'convert'] and not os.path.isfile(base + '.raw.oneh5')):
+		import loadh5
+		loadh5.cvcorr(base, par['na'], base + '.raw.oneh5')
+
+
+def run(par, names, wdir):
+	# run the stages names in wdir, each in its own process
+	# returns [{'name': .., 'wall': .., 'maxrss_mb': .., ...}, ...]
+	sys.path.insert(0, bindir)
+	env = dict(os.environ, MPLBACKEND='Agg')
+	res = []
+	for (name, target, args) in stages:
+		if (not name in names):
+			continue
+		_prepare(name, par, wdir)
+		args = [a.format(**par) for a in args]
+		fjson = os.path.join(wdir, name + '.bench.json')
+		if (os.path.isfile(fjson)):
+			os.remove(fjson)
+		print '%-10s %s %s' % (name, target, ' '.join(args))
+		t0 = time.time()
+		with open(os.path.join(wdir, name + '.log'), 'w') as log:
+			subprocess.call([sys.executable, os.path.abspath(__file__), '-child', fjson, target] + args,
+				cwd=wdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+		r = {'status': 'no result (see %s.log)' % name}
+		if (os.path.isfile(fjson)):
+			with open(fjson) as f:
+				r = json.load(f)
+		r['name'] = name
+		r['cmd'] = ' '.join([target] + args)
+		r['total'] = time.time() - t0		# including interpreter startup
+		res.append(r)
+		print '%-10s %8.2f s  %8.1f MB  %s' % ('', r.get('wall', np.nan), r.get('maxrss_mb', np.nan), r['status'])
+	return res
+
+
+def _version():
+	# git revision of the package, if it is a git checkout
+	try:
+		return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+			cwd=bindir, stderr=subprocess.STDOUT).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def report(fjson, par, res):
+	import h5py
+	import loadh5
+	out = {
+		'date':		datetime.now().isoformat(),
+		'host':		socket.gethostname(),
+		'python':	sys.version.split()[0],
+		'numpy':	np.__version__,
+		'h5py':		h5py.version.version,
+		'revision':	_version(),
+		'oneh5_version': loadh5.oneh5_version,
+		'params':	par,
+		'stages':	res,
+	}
+	with open(fjson, 'w') as f:
+		json.dump(out, f, indent=1, sort_keys=True)
+	print 'results saved in', fjson
+
+
+def compare(fold, fnew, tol=0.2):
+	# stage by stage ratio new/old of wall time, peak RSS and bytes read;
+	# ratios above 1+tol are marked
+	with open(fold) as f:
+		old = json.load(f)
+	with open(fnew) as f:
+		new = json.load(f)
+	print 'old: %s (%s)' % (fold, old.get('revision'))
+	print 'new: %s (%s)' % (fnew, new.get('revision'))
+	if (old['params'] != new['params']):
+		print 'warning: different parameters', old['params'], new['params']
+	ostage = dict([(r['name'], r) for r in old['stages']])
+	print '%-10s %10s %10s %7s %8s %8s' % ('stage', 'old(s)', 'new(s)', 'wall', 'rss', 'rchar')
+	for r in new['stages']:
+		o = ostage.get(r['name'])
+		if (o is None):
+			continue
+		ratio = []
+		for k in ['wall', 'maxrss_mb', 'rchar']:
+			if (o.get(k) and r.get(k) is not None):
+				ratio.append(r[k] / float(o[k]))
+			else:
+				ratio.append(np.nan)
+		flag = '  <--' if (max(ratio) > 1. + tol) else ''
+		print '%-10s %10.2f %10.2f %7.2f %8.2f %8.2f%s' % ((r['name'], o.get('wall', np.nan), r.get('wall', np.nan)) + tuple(ratio) + (flag,))
+
+
+
+if (__name__ == '__main__'):
+
+    inp = sys.argv[0:]
+    pg  = inp.pop(0)
+    usage = '''
+    time the YTLA tools on synthetic data (see mksynth.py): every stage
+    runs in its own process, its wall time, peak RSS and bytes read and
+    written (Linux) are saved to a JSON file
+
+    %s [options]
+    %s -cmp <old.json> <new.json>
+
+	options are:
+	-na N		# number of antennas (default 7)
+	-nch N		# number of channels (default 1024)
+	-ndata N	# number of integrations (default 2000)
+	-stages s1,s2	# stages to run (default all: %s)
+	-dir DIR	# work directory (default: temporary, removed after)
+	-o out.json	# results (default bench_<na>x<nch>x<ndata>.json)
+
+	-cmp prints the new/old ratios of two result files
+
+    ''' % (pg, pg, ','.join([s[0] for s in stages]))
+
+    if (len(inp) >= 2 and inp[0] == '-child'):
+	child(inp[1], inp[2], inp[3:])
+	sys.exit()
+
+    if (len(inp) >= 3 and inp[0] == '-cmp'):
+	compare(inp[1], inp[2])
+	sys.exit()
+
+    par = {'na': 7, 'nch': 1024, 'ndata': 2000, 'base': 'synth'}
+    names = [s[0] for s in stages]
+    wdir = None
+    fjson = None
+    while (inp):
+	arg = inp.pop(0)
+	try:
+	    if (arg in ['-na', '-nch', '-ndata']):
+		par[arg[1:]] = int(inp.pop(0))
+	    elif (arg == '-stages'):
+		names = inp.pop(0).split(',')
+	    elif (arg == '-dir'):
+		wdir = inp.pop(0)
+	    elif (arg == '-o'):
+		fjson = inp.pop(0)
+	    elif (arg in ['-h', '--help']):
+		print usage
+		sys.exit()
+	    else:
+		print 'unknown option:', arg
+	except (ValueError, IndexError):
+	    print 'error reading option:', arg
+
+    if (fjson is None):
+	fjson = 'bench_%dx%dx%d.json' % (par['na'], par['nch'], par['ndata'])
+    keep = wdir is not None
+    if (keep):
+	if (not os.path.isdir(wdir)):
+	    os.makedirs(wdir)
+    else:
+	wdir = tempfile.mkdtemp(prefix='bench_ytla.')
+    print 'work directory:', wdir
+
+    nb = par['na'] * (par['na']-1) / 2
+    par['data_mb'] = 2 * (par['na'] + 2 * nb) * par['nch'] * par['ndata'] * 4 / 1.e6	# float32 correlator files
+    try:
+	res = run(par, names, wdir)
+	report(fjson, par, res)
+    finally:
+	if (not keep):
+	    shutil.rmtree(wdir)
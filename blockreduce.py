@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+import numpy as np
+from ytlatrace import span
+
+# out-of-core reductions of a oneh5 cube (nsb, nb|na, nch, ndata), read in
+# time blocks of bounded size:
+#
+#	r = Reducer(axis=(2,), stats=['mean'], chrange=[20, 760])
+#	for (t0, t1, blk) in blocks('x.raw.oneh5', 'cross'):
+#		r.add(blk, t0)
+#	cross_ca = r.result()['mean']
+#
+# or, for one reduction, blkreduce('x.raw.oneh5', 'cross', (2,), ...).
+# the statistics are sum, count, mean, var, std, min and max; partial
+# results of blocks are merged exactly (sums in double precision, var by
+# the pairwise update of Chan et al.), so the order of the blocks or the
+# block size only changes the round-off. min/max of complex data are
+# those of |x|.
+#
+# with nproc > 1 (the -j option of the tools, see argv), run() splits the
+# time range of a oneh5 file into nproc shards, each reduced by a worker
+# process with its own reader, and merges the partial results in time
+# order. the workers are started once, before any file is opened (see
+# startpool). pre functions must then be picklable: module-level
+# functions or functools.partial of them (e.g. partial(gainslope, gs=gs)),
+# no lambdas.
+
+blockmem = 256 * 1024**2	# default max. size of a block (bytes), all workers
+nproc	 = 1			# default number of worker processes of run()
+_workers = None			# their pool, see startpool
+statnames = ['sum', 'count', 'mean', 'var', 'std', 'min', 'max']
+
+
+def tblocksize(shape, dtype, mem=None):
+	# integrations per block of a (..., ndata) cube so that a block stays
+	# below mem bytes (default blockmem)
+	if (mem is None):
+		mem = blockmem
+	nbytes = np.dtype(dtype).itemsize * int(np.prod(shape[:-1]))
+	return int(max(1, min(shape[-1], mem // max(1, nbytes))))
+
+
+def blocks(src, xtype=None, trange=None, tblock=None, chrange=None):
+	# yield (t0, t1, xtype[:, :, chrange, t0:t1]) for the time blocks of
+	# trange ([start, stop), None = all); src is a oneh5 file name, an open
+	# OneH5Reader, or the cube array itself (xtype is then not used).
+	# tblock = None: blocks of at most blockmem bytes
+	from loadh5 import OneH5Reader
+	if (isinstance(src, basestring)):
+		with OneH5Reader(src) as r:
+			for blk in blocks(r, xtype, trange, tblock, chrange):
+				yield blk
+		return
+
+	if (hasattr(src, 'block')):	# a reader (not isinstance: loadh5 may
+					# also run as __main__, another class)
+		n = src.na if (xtype == 'auto') else src.nb
+		shape = (src.nsb, n, src.nch, src.ndata)
+		dtype = src.adtype if (xtype == 'auto') else src.cdtype
+		get = lambda t0, t1: src.block(xtype, chrange, [t0, t1])
+	else:
+		shape = src.shape
+		dtype = src.dtype
+		cs = slice(None) if (chrange is None) else slice(chrange[0], chrange[1])
+		get = lambda t0, t1: src[:, :, cs, t0:t1]
+
+	(i0, i1) = (0, shape[-1]) if (trange is None) else (trange[0], min(trange[1], shape[-1]))
+	if (tblock is None):
+		tblock = tblocksize(shape, dtype)
+	for t0 in range(i0, i1, tblock):
+		t1 = min(t0 + tblock, i1)
+		yield (t0, t1, get(t0, t1))
+
+
+def _partial(x, axis, stats):
+	# the mergeable statistics of x over axis
+	p = {'n': int(np.prod([x.shape[a] for a in axis]))}
+	acc = np.result_type(x.dtype, np.float64)
+	p['sum'] = x.sum(axis=axis, dtype=acc)
+	if ('var' in stats or 'std' in stats):
+		m = p['sum'] / float(p['n'])
+		d = x - m.reshape(_keep(x.shape, axis))
+		p['m2'] = (d.real**2 + d.imag**2).sum(axis=axis) if (np.iscomplexobj(d)) else (d**2).sum(axis=axis)
+	if ('min' in stats or 'max' in stats):
+		a = np.abs(x) if (np.iscomplexobj(x)) else x
+		p['min'] = a.min(axis=axis)
+		p['max'] = a.max(axis=axis)
+	return p
+
+
+def _keep(shape, axis):
+	# shape with the reduced axes kept as length 1
+	return tuple([1 if (k in axis) else shape[k] for k in range(len(shape))])
+
+
+def merge(a, b):
+	# merge the partial statistics a and b (of disjoint samples)
+	if (a is None):
+		return b
+	if (b is None):
+		return a
+	n = a['n'] + b['n']
+	p = {'n': n, 'sum': a['sum'] + b['sum']}
+	if ('m2' in a):
+		d = b['sum'] / float(b['n']) - a['sum'] / float(a['n'])
+		d2 = d.real**2 + d.imag**2 if (np.iscomplexobj(d)) else d**2
+		p['m2'] = a['m2'] + b['m2'] + d2 * (a['n'] * b['n'] / float(n))
+	if ('min' in a):
+		p['min'] = np.minimum(a['min'], b['min'])
+		p['max'] = np.maximum(a['max'], b['max'])
+	return p
+
+
+def finish(p, stats):
+	# {stat: array} of the partial statistics p
+	out = {}
+	for s in stats:
+		if (s == 'sum'):
+			out[s] = p['sum']
+		elif (s == 'count'):
+			out[s] = p['n']
+		elif (s == 'mean'):
+			out[s] = p['sum'] / float(p['n'])
+		elif (s == 'var'):
+			out[s] = p['m2'] / float(p['n'])
+		elif (s == 'std'):
+			out[s] = np.sqrt(p['m2'] / float(p['n']))
+		elif (s in ['min', 'max']):
+			out[s] = p[s]
+	return out
+
+
+class Reducer(object):
+    # statistics of the blocks of a cube (nsb, n, nch, ndata) over the
+    # given axes. if time (axis 3) is reduced, the blocks are merged;
+    # otherwise the per-block results are joined along time.
+    # chrange restricts the channels ([start, stop), None = all).
+
+    def __init__(self, axis, stats=('mean',), chrange=None):
+	self.axis = tuple(sorted(axis))
+	self.stats = list(stats)
+	for s in self.stats:
+	    if (not s in statnames):
+		raise ValueError('unknown statistic: %s' % s)
+	self.chrange = chrange
+	self.acc = None		# merged partial, time reduced
+	self.parts = []		# [(t0, results)], time kept
+
+
+    def add(self, blk, t0=0):
+	# add the block blk = cube[..., t0:t0+nt]
+	if (self.chrange is not None):
+	    blk = blk[:, :, self.chrange[0]:self.chrange[1]]
+	p = _partial(blk, self.axis, self.stats)
+	if (3 in self.axis):
+	    self.acc = merge(self.acc, p)
+	else:
+	    self.parts.append((t0, finish(p, self.stats)))
+
+
+    def empty(self):
+	# a new Reducer of the same axis/stats/chrange, with no data
+	return Reducer(self.axis, self.stats, self.chrange)
+
+
+    def merge(self, other):
+	# merge the Reducer other (same axis/stats, other blocks) into this
+	if (3 in self.axis):
+	    self.acc = merge(self.acc, other.acc)
+	else:
+	    self.parts.extend(other.parts)
+
+
+    def result(self):
+	# {stat: array}
+	if (3 in self.axis):
+	    if (self.acc is None):
+		return None
+	    return finish(self.acc, self.stats)
+	if (not self.parts):
+	    return None
+	parts = [x[1] for x in sorted(self.parts, key=lambda x: x[0])]
+	out = {}
+	for s in self.stats:
+	    if (s == 'count'):
+		out[s] = parts[0][s]
+	    else:
+		out[s] = np.concatenate([x[s] for x in parts], axis=-1)
+	return out
+
+
+def run(src, xtype, reducers, pre=None, trange=None, tblock=None, chrange=None, nproc=None):
+	# one pass over the time blocks of src (see blocks), each block is
+	# given to every Reducer of reducers; pre(blk) is applied first
+	# (e.g. a calibration or the closure products) and must act on each
+	# integration independently. only the channels chrange are read (and
+	# seen by pre). returns [r.result() for r in reducers]
+	# nproc: worker processes (None: the module default); arrays are
+	# always reduced in this process
+	from loadh5 import OneH5Reader
+	if (nproc is None):
+		nproc = globals()['nproc']
+	if (nproc > 1 and isinstance(src, basestring)):
+		with OneH5Reader(src) as r:
+			return run(r, xtype, reducers, pre, trange, tblock, chrange, nproc)
+
+	sp = span('reduce', xtype=xtype)
+	if (nproc > 1 and hasattr(src, 'block') and startpool(nproc) is not None):
+		_pool(src, xtype, reducers, pre, trange, tblock, chrange, nproc)
+	else:
+		for (t0, t1, blk) in blocks(src, xtype, trange, tblock, chrange):
+			sp.add(blk.nbytes)
+			if (pre is not None):
+				blk = pre(blk)
+			for r in reducers:
+				r.add(blk, t0)
+	sp.close()
+	return [r.result() for r in reducers]
+
+
+def startpool(n=None):
+	# the worker processes of run(): a pool of n (default nproc) processes,
+	# started on the first call. a worker forked while h5py files are open
+	# would share their file offsets with this process, so the pool must be
+	# started before any file is opened (argv does); otherwise None is
+	# returned and run() reduces in this process
+	global _workers
+	if (_workers is None):
+		import h5py
+		if (h5py.h5f.get_obj_count(h5py.h5f.OBJ_ALL, h5py.h5f.OBJ_FILE) > 0):
+			print 'warning: h5 files are open, no worker processes started'
+			return None
+		import multiprocessing
+		_workers = multiprocessing.Pool(n or nproc)
+	return _workers
+
+
+def _pool(r, xtype, reducers, pre, trange, tblock, chrange, nproc):
+	# run() of nproc time shards of the reader r on the worker pool; the
+	# workers' reducers are merged into reducers
+	(i0, i1) = (0, r.ndata) if (trange is None) else (trange[0], min(trange[1], r.ndata))
+	if (tblock is None):
+		## the blocks of all workers together stay below blockmem
+		n = r.na if (xtype == 'auto') else r.nb
+		dtype = r.adtype if (xtype == 'auto') else r.cdtype
+		tblock = tblocksize((r.nsb, n, r.nch, r.ndata), dtype, blockmem // nproc)
+	edges = np.linspace(i0, i1, nproc+1).astype(int)
+	tasks = []
+	for k in range(nproc):
+		if (edges[k+1] > edges[k]):
+			tasks.append((r.__class__, r.reopen, xtype, [x.empty() for x in reducers],
+				pre, [edges[k], edges[k+1]], tblock, chrange))
+	parts = startpool().map(_shard, tasks)
+	for part in parts:
+		for (x, y) in zip(reducers, part):
+			x.merge(y)
+
+
+def _shard(task):
+	# worker of _pool: reduce one shard with a reader of its own, of the
+	# class and constructor arguments (reopen) of the parent's reader
+	(cls, args, xtype, reducers, pre, trange, tblock, chrange) = task
+	with cls(*args) as r:
+		run(r, xtype, reducers, pre, trange, tblock, chrange, nproc=1)
+	return reducers
+
+
+def blkreduce(src, xtype, axis, stats=('mean',), chrange=None, **kwargs):
+	# statistics of xtype[:, :, chrange] over axis (see Reducer), in
+	# one pass; kwargs: pre, trange, tblock (see run)
+	return run(src, xtype, [Reducer(axis, stats)], chrange=chrange, **kwargs)[0]
+
+
+def argv(inp):
+	# remove '-j N' from the argument list inp (in place) and set the
+	# default number of worker processes accordingly
+	global nproc
+	if (not '-j' in inp):
+		return inp
+	k = inp.index('-j')
+	inp.pop(k)
+	try:
+		nproc = max(1, int(inp.pop(k)))
+	except (ValueError, IndexError):
+		print 'error reading option: -j'
+	if (nproc > 1):
+		startpool(nproc)
+	return inp
+
+
+def gainslope(blk, gs):
+	# multiply the blocks by a gain slope of gs dB across the channels
+	# (as drawpdf.corr2pdf)
+	nch = blk.shape[2]
+	gcal = 10**(np.arange(nch) * gs/10./float(nch))
+	return blk * gcal.reshape(1, 1, nch, 1)
@@ -4,11 +4,16 @@ import sys
 import os.path
 from subprocess import call
 from loadh5 import *
+from visdata import *
+from blockreduce import Reducer, blocks
+import ytlatrace
+import blockreduce
+from ytlatrace import span
 from scipy import signal
 
 
 #-- defaults --
-inp 	= sys.argv[0:]
+inp 	= blockreduce.argv(ytlatrace.argv(sys.argv[0:]))
 pg  	= inp.pop(0)
 nch	= 1024
 nsb	= 2
@@ -50,6 +55,9 @@ syntax %s <raw_oneh5_file> <cal_oneh5_file> [options]
 
 	-filter sigma	# sigma for Gaussian spectral filtering (%d channels)
 
+	-j N	# reduce on N processes (default 1)
+	-trace [f.json]	# time the phases (summary table, JSON trace to f.json)
+
 
 ''' % (pg, phasecal, gaincal, gsigma)
 
@@ -152,17 +160,23 @@ outh5 = rawdir + '/' + outbase + '.oneh5'
 
 
 #-- loading data --
-(rawtime, rawauto, rawcross) = ldoneh5(rawh5)
-nraw = len(rawtime)
+## the raw data is read (and calibrated) block by block, see blockreduce
+rawr = OneH5Reader(rawh5)
+rawtime = rawr.timestamp()
+(nsb, na, nch, nraw) = rawr.shape
+nb = rawr.nb
 
 if (loadcal):
+	## only the time-averaged cal. cross is needed: read it from the
+	## stored summary (full time range) or average it block by block
 	if (calh5 == 'self'):
-		(caltime, calauto, calcross) = (rawtime, rawauto, rawcross)
+		calr = OneH5Reader(rawh5)
 	else:
-		(caltime, calauto, calcross) = ldoneh5(calh5)
+		calr = OneH5Reader(calh5)
+	caltime = calr.timestamp()
 	#ncal = len(caltime)
-	(nsb, nb, nch, ncal) = calcross.shape
-	# calcross has shape of (nsb, nb, nch, ncal)
+	(nsb, nb, nch, ncal) = (calr.nsb, calr.nb, calr.nch, calr.ndata)
+	# the cal cross has shape of (nsb, nb, nch, ncal)
 	# with nsb = 2, nch = 1024 defined in loadh5.py
 
 	## time avg cal data to get a single phassband (not normalized yet)
@@ -181,7 +195,10 @@ if (loadcal):
 		print 'warning: invalid cal time range. use all range.'
 		tw = np.ones(caltime.size, dtype='bool')
 	    
-	avgcal = calcross[:,:,:,tw].mean(axis = 3)
+	## tw is a contiguous range since time is increasing
+	wi = np.nonzero(tw)[0]
+	avgcal = calr.tavg('cross', [wi[0], wi[-1]+1])
+	calr.close()
 
 	## perform spectral smoothing if a Gaussian sigma is provided
 	if (gsigma > 0.):
@@ -220,14 +237,33 @@ if (flux_jy > 0.):
 
 
 #-- passband cal --
-## in-placecal instead of copy array to save memory
-for i in range(nraw):
-	rawcross[:,:,:,i] = rawcross[:,:,:,i] / avgcal[:,:,:]
-
-
+## time blocks of the raw cross are calibrated in place and written out;
+## the channel avg of the calibrated cross is made on the way
+sp = span('passband cal')
+rawca = Reducer((2,), ['mean'], [chmin, chmax])
 if (outadj != 'null'):
 	print 'saving calibrated vis in %s' % outh5
-	wtoneh5(outh5, rawtime, rawauto, rawcross)
+	prec = 'single' if (rawr.cdtype == np.complex64) else 'double'
+	fo = crtoneh5(outh5, rawtime, na, nch, nraw, precision=prec)
+else:
+	fo = None
+
+## (in this process: the output file has a single writer; -j applies
+## to the cal. average and to the summaries of the output)
+for (i0, i1, blk) in blocks(rawr, 'cross'):
+	blk /= avgcal[:,:,:,None]
+	rawca.add(blk, i0)
+	if (fo is not None):
+		fo['cross'][:,:,:,i0:i1] = blk
+		fo['auto'][:,:,:,i0:i1]  = rawr.block('auto', None, [i0, i1])
+	sp.add(blk.nbytes)
+rawr.close()
+sp.close()
+
+
+if (fo is not None):
+	fo.close()
+	smoneh5(outh5)
 	print 'adding relative passband'
 	#adoneh5(outh5, avgcal, 'passband')
 	print 'adding normalzation of passband (not used in passband cal)'
@@ -244,7 +280,7 @@ if (outadj != 'null'):
 
 
 #-- channel avg --
-rawcross_ca = rawcross[:,:,chmin:chmax,:].mean(axis = 2)
+rawcross_ca = rawca.result()['mean']
 
 
 
@@ -254,17 +290,17 @@ call(['mkdir', '-p', ascdir])
 sb	= ['lsb', 'usb']
 
 print 'saving ascii outputs'
+sp = span('ascii output', dir=ascdir)
+bi = BaselineIndex(na)
 for s in range(nsb):
-	b = -1
-	for i in range(na-1):
-		for j in range(i+1, na):
-			b += 1
-			outname = ascdir + '/' + rawbase.rstrip('.raw') + '.%d%d.' % (i, j) + sb[s] + '_time'
-
-			f = open(outname, 'w')
-			for k in range(nraw):
-				print >> f, np.abs(rawcross_ca[s, b, k])
-			f.close()
+	for b in range(bi.nb):
+		outname = ascdir + '/' + rawbase.rstrip('.raw') + '.' + bi.name(b) + '.' + sb[s] + '_time'
+
+		f = open(outname, 'w')
+		for k in range(nraw):
+			print >> f, np.abs(rawcross_ca[s, b, k])
+		f.close()
+sp.close()
 
 print 'done.'
 
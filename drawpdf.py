@@ -7,6 +7,9 @@ import numpy as np
 from matplotlib.backends.backend_pdf import PdfPages
 import matplotlib.pyplot as plt
 import sys
+from ytlatrace import span
+from blockreduce import Reducer, run, gainslope
+from functools import partial
 
 
 
@@ -28,26 +31,79 @@ def corr2pdf(fout, time, auto, cross, **kwargs):
 			print 'error: option %s is not defined.' % k 
 			return None
 
+	tlim	= kwargs.pop('tlim', [])			# time range to avg/plot
+	chlim	= kwargs.pop('chlim', [5, 750])			# channel range to avg
+	gs	= kwargs.pop('gs', 0.)				# gain slope to multiply (in dB across ~1000ch)
+
+	if (tlim):
+		print '... tset = True'
+		tset = True
+		tmin = tlim[0]
+		tmax = tlim[1]
+	else:
+		tset = False
+
+
+
+	t2 = time[:] - time[0]		# relative time
+
+	## construct array range from time limit
+	## (a contiguous range since time is increasing)
+	if (tset):
+		tw = np.nonzero(np.logical_and(t2 >= tmin, t2 <= tmax))[0]
+		if (len(tw) == 0):
+			print 'error: no integration in tlim', tlim, '(data: 0 - %.3f s), %s not made' % (t2[-1], fout)
+			return None
+		trange = [tw[0], tw[-1]+1]
+	else:
+		trange = [0, time.size]
+	t2 = t2[trange[0]:trange[1]]
+
+
+	## averaging, block by block (see blockreduce); the gain slope
+	## correction is applied to each block
+	sp = span('average')
+	pre = partial(gainslope, gs=gs) if (gs != 0.) else None
+	(ta, ca) = run(auto, None, [Reducer((3,)), Reducer((2,), chrange=chlim)], trange=trange)
+	(auto_ta, auto_ca) = (ta['mean'], ca['mean'])
+	(ta, ca) = run(cross, None, [Reducer((3,)), Reducer((2,), chrange=chlim)], pre=pre, trange=trange)
+	(cross_ta, cross_ca) = (ta['mean'], ca['mean'])
+	sp.close()
+
+	sum2pdf(fout, t2, auto_ta, cross_ta, auto_ca, cross_ca, **kwargs)
+
+
+
+def sum2pdf(fout, t2, auto_ta, cross_ta, auto_ca, cross_ca, **kwargs):
+	# plot the time-averaged spectra and the channel-averaged time series
+	# numpy arrays:
+	#	t2(ndata), float, relative time
+	#	auto_ta(nsb, na, nch), float
+	#	cross_ta(nsb, nb, nch), complex
+	#	auto_ca(nsb, na, ndata), float
+	#	cross_ca(nsb, nb, ndata), complex
+
+	(nsb, na, nch) = auto_ta.shape
+	nb = na * (na-1) / 2
+
+
+	# the defaults
+	valid_op = ['cylim', 'tylim', 'ys', 'logy', 'pylim', 'figsize']
+	for k in kwargs:
+		if (not(k in valid_op)):
+			print 'error: option %s is not defined.' % k 
+			return None
+
 	opts = {
-		'tlim'	: kwargs.get('tlim', []),		# time range to avg/plot
 		'cylim'	: kwargs.get('cylim', []),		# plot range of amp-channel
 		'tylim'	: kwargs.get('tylim', []),		# plot range of amp-time
 	}
 	ys 	= kwargs.get('ys', 'common')			# 'common' or 'indi'
 	logy	= kwargs.get('logy', False)			# y-axis log-scale or not
-	chlim	= kwargs.get('chlim', [5, 750])			# channel range to avg
 	pylim	= kwargs.get('pylim', [-3.5, 3.5])		# plot range of phase
 	figinch = kwargs.get('figsize', (10, 7.5))		# fig size in (x, y) inches
 								# (dpi = 100?)
-	gs	= kwargs.get('gs', 0.)				# gain slope to multiply (in dB across ~1000ch)
 
-	if (opts['tlim']):
-		print '... tset = True'
-		tset = True
-		tmin = opts['tlim'][0]
-		tmax = opts['tlim'][1]
-	else:
-		tset = False
 	if (opts['cylim']):
 		print '... cyset = True'
 		cyset = True
@@ -64,33 +120,8 @@ def corr2pdf(fout, time, auto, cross, **kwargs):
 		tyset = False
 
 
-
-	t2 = time[:] - time[0]		# relative time
 	ch = np.array(range(nch))	# channel number
 
-	## construct array range from time limit
-	if (tset):
-		tw = np.logical_and(t2 >= tmin, t2 <= tmax)
-	else:
-		tw = np.ones(time.size, dtype=bool)
-
-	## over-load the arrays according to time range
-	t2    = t2[tw]
-	auto  = auto[:,:,:,tw]
-	cross = cross[:,:,:,tw]
-
-
-	## apply gain slope correction
-	if (gs != 0.):
-	    gcal = np.ones((1,1,nch,1))
-	    gcal[0,0,:,0] = 10**(ch * gs/10./float(nch))
-	    cross *= gcal
-	    
-
-
-	## averaging
-	auto_ta  = auto.mean(axis=3)
-	cross_ta = cross.mean(axis=3)
 	if (ys == 'common' and not(cyset)):	# do not override the user-set range
 		cymax = np.abs(cross_ta).max()
 		if (logy):
@@ -99,8 +130,6 @@ def corr2pdf(fout, time, auto, cross, **kwargs):
 			cymin = 0.
 		cyset = True
 
-	auto_ca  = auto[:,:,chlim[0]:chlim[1],:].mean(axis=2)
-	cross_ca = cross[:,:,chlim[0]:chlim[1],:].mean(axis=2)
 	if (ys == 'common' and not(tyset)):	# do not override the user-set range
 		tymax = np.abs(cross_ca).max()
 		if (logy):
@@ -113,6 +142,7 @@ def corr2pdf(fout, time, auto, cross, **kwargs):
 
 	#-- make plots --
 	#fout = fplt + '.pdf'
+	sp = span('plot', file=fout)
 	pdf  = PdfPages(fout)
 
 
@@ -299,6 +329,7 @@ def corr2pdf(fout, time, auto, cross, **kwargs):
 
 
 	pdf.close()
+	sp.close()
 
 
 
@@ -20,15 +20,38 @@ import matplotlib
 matplotlib.use('Qt5Agg')
 from PyQt5 import QtCore, QtWidgets
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
 
 import numpy as np
 from numpy import arange, sin, pi
+from functools import partial
 from loadh5 import *
+from visdata import *
+import ytlatrace
+from ytlatrace import span
 
+readmem = 64 * 1024**2	# bytes of a baseline read per block (progress, cancel)
 
 
 
+def envelope(x, y, n):
+	# (x, y) reduced to about n points for display: the min. and max. of y
+	# in each of n/2 bins of consecutive points, in their order, plus the
+	# first and last points, so that peaks and the extent stay visible.
+	# returned as is if it has no more than n points
+	npt = len(y)
+	if (npt <= n):
+		return (x, y)
+	nbin = max(1, n // 2)
+	m = -(-npt // nbin)		# points per bin, the last bin padded
+	yy = np.concatenate((y, np.repeat(y[-1:], nbin * m - npt))).reshape(nbin, m)
+	k = np.arange(nbin) * m
+	idx = np.concatenate(([0, npt-1], k + yy.argmin(axis=1), k + yy.argmax(axis=1)))
+	idx = np.unique(np.minimum(idx, npt-1))
+	return (x[idx], y[idx])
+
+
 
 class MyMplCanvas(FigureCanvas):
     """Ultimately, this is a QWidget (as well as a FigureCanvasAgg, etc.)."""
@@ -55,9 +78,23 @@ class MyMplCanvas(FigureCanvas):
 class MyInteractCanvas(MyMplCanvas):
     """Canvas to plot loaded data"""
 
+    # a trace of more than ppx points per pixel of the axes width is drawn
+    # as its min/max envelope (see envelope), made again from the full
+    # resolution data for the visible range when the x range changes
+    # (zoom, pan); ppx = 0 draws every point
+    ppx = 2
+
+    def compute_initial_figure(self):
+	self.traces = []	# [(ax, line, x, y)], x, y at full resolution
+	self.watched = []	# the axes whose x range is followed
+
+
     def clear(self):
 	self.ampax.cla()
 	self.phaax.cla()
+	# cla() also drops the callbacks of the axes
+	self.traces = []
+	self.watched = []
 
 
     def add_trace(self, panel, x, y, **kwargs):
@@ -66,11 +103,37 @@ class MyInteractCanvas(MyMplCanvas):
 	elif (panel == 'pha'):
 	    ax = self.phaax
 
-	ax.plot(x, y, **kwargs)
+	x = np.asarray(x)
+	y = np.asarray(y)
+	(xd, yd) = self.decimate(ax, x, y)
+	line, = ax.plot(xd, yd, **kwargs)
+	if (len(xd) < len(x) and np.all(np.diff(x) >= 0)):
+	    self.traces.append((ax, line, x, y))
+	    if (not ax in self.watched):
+		ax.callbacks.connect('xlim_changed', self.redecimate)
+		self.watched.append(ax)
 	ax.legend()
 	self.draw()
 
 
+    def decimate(self, ax, x, y):
+	# (x, y) reduced for the width of ax
+	if (self.ppx <= 0):
+	    return (x, y)
+	return envelope(x, y, max(2, int(self.ppx * ax.bbox.width)))
+
+
+    def redecimate(self, ax):
+	# the traces of ax, decimated again over its new x range
+	(x0, x1) = sorted(ax.get_xlim())
+	for (a, line, x, y) in self.traces:
+	    if (a is ax):
+		i0 = max(0, np.searchsorted(x, x0) - 1)
+		i1 = min(len(x), np.searchsorted(x, x1) + 1)
+		line.set_data(*self.decimate(ax, x[i0:i1], y[i0:i1]))
+	self.draw_idle()
+
+
     def update_info(self, panel, **kwargs):
 	if (panel == 'amp'):
 	    ax = self.ampax
@@ -112,13 +175,90 @@ class MyInteractCanvas(MyMplCanvas):
 
 
 
+class LoadCancelled(Exception):
+    pass
+
+
+
+def opendata(fname, na, cache, report):
+	# the data of the file as a dict: reader (a OneH5Reader or a
+	# CorrReader), time, tindex, shape. only the timestamp is read here;
+	# baselines are read on demand (and kept in cache)
+	out = {'fname': fname, 'reader': None}
+	try:
+		sp = span('load', file=fname)
+		report(0, 2, 'open')
+		if (fname.find('.oneh5') > -1):
+			out['reader'] = OneH5Reader(fname, cache=cache)
+		elif (fname.find('.timestamp') > -1):
+			out['reader'] = CorrReader(fname, na, cache=cache)
+		else:
+			raise IOError('not a .oneh5 or .timestamp file')
+		report(1, 2, 'timestamp')
+		out['time'] = out['reader'].timestamp()
+		out['tindex'] = out['reader'].tindex
+		out['shape'] = out['reader'].shape
+		report(2, 2, 'timestamp')
+		sp.close()
+	except:
+		if (out['reader'] is not None):
+			out['reader'].close()
+		raise
+	return out
+
+
+
+class Loader(QtCore.QThread):
+    """Run job(report) in a worker thread (see ApplicationWindow.startjob):
+    open a file or read a baseline. report(done, total, step) emits the
+    progress and stops the job after cancel()"""
+
+    progress = QtCore.pyqtSignal(int, int, str)	# done, total, step
+    loaded   = QtCore.pyqtSignal(object)	# the result of job
+    failed   = QtCore.pyqtSignal(str)		# error message
+
+    def __init__(self, job, label, parent=None):
+	QtCore.QThread.__init__(self, parent)
+	self.job = job
+	self.label = label
+	self.done = None	# called with the result (set by startjob)
+	self.stop = False
+
+
+    def cancel(self):
+	# stop at the next block (the data read so far is dropped)
+	self.stop = True
+
+
+    def report(self, done, total, step):
+	if (self.stop):
+	    raise LoadCancelled()
+	self.progress.emit(done, total, step)
+
+
+    def run(self):
+	try:
+	    out = self.job(self.report)
+	except LoadCancelled:
+	    self.failed.emit('%s: cancelled' % self.label)
+	    return
+	except Exception as e:
+	    self.failed.emit('error loading %s: %s' % (self.label, e))
+	    return
+	self.loaded.emit(out)
+
+
+
 class ApplicationWindow(QtWidgets.QMainWindow):
 
-    def __init__(self, fname='', bindir=''):
+    def __init__(self, fname='', bindir='', cachemem=None):
         QtWidgets.QMainWindow.__init__(self)
 
 	self.fname = fname
 	self.bindir = bindir
+	self.reader = None	# OneH5Reader or CorrReader of the loaded file
+	self.loader = None	# Loader, while a file or a baseline is being loaded
+	self.cache = SliceCache(cachemem)	# the baselines read, all files
 
 	self.initUI()
 
@@ -173,6 +313,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 	#self.right.layout.addWidget(self.ampplot, 0, 0)
 	#self.right.layout.addWidget(self.phaplot, 1, 0)
 	self.right.layout.addWidget(self.plot, 0, 0, 3, 1)
+	self.toolbar = NavigationToolbar(self.plot, self.right)
+	self.right.layout.addWidget(self.toolbar, 3, 0)
 
 	self.right.saveBtn = QtWidgets.QPushButton('Save fig ...', self.right)
 	self.right.layout.addWidget(self.right.saveBtn, 0, 1)
@@ -257,6 +399,16 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.main.setFocus()
         self.setCentralWidget(self.main)
 	self.move(50,50)
+
+	# status bar -- loading progress
+	self.loadBar = QtWidgets.QProgressBar(self)
+	self.loadBar.setMaximumWidth(200)
+	self.statusBar().addPermanentWidget(self.loadBar)
+	self.cancelBtn = QtWidgets.QPushButton('Cancel', self)
+	self.cancelBtn.clicked.connect(self.cancelload)
+	self.statusBar().addPermanentWidget(self.cancelBtn)
+	self.loadBar.hide()
+	self.cancelBtn.hide()
         #self.statusBar().showMessage("All hail matplotlib!", 2000)
 
 
@@ -338,14 +490,14 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 	    print 'error finding timestamp file:', self.tsname
 	    return 1
 
-	rawname = self.tsname.rstrip('.timestamp') + '.raw.oneh5'
+	rawname = self.tsname
+	if (rawname.endswith('.timestamp')):
+	    rawname = rawname[:-len('.timestamp')]
+	rawname += '.raw.oneh5'
 	print 'output to ', rawname
 
-	time, auto, cross = ldcorr(self.tsname, self.na)
-	print 'reading done.'
-
-	wtoneh5(rawname, time, auto, cross)
-	print 'writing done.'
+	cvcorr(self.tsname, self.na, rawname)
+	print 'conversion done.'
 	
 
 
@@ -759,38 +911,94 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
 
     def loadfile(self):
+	# the file is loaded by a Loader thread; the data loaded before stays
+	# in use until it is done (see loaded)
 	fname = self.fileLE.text()
 	if (self.fname):
-	    pass
-	elif (fname != ''):
-	    self.fname = fname
-	    self.fileLab.setText(fname)
+	    fname = self.fname
 	    
-	if (self.fname):
-	    if (self.fname.find('.oneh5') > -1):
-		self.time, self.auto, self.cross = ldoneh5(self.fname)
-	    elif (self.fname.find('.timestamp') > -1):
-		self.time, self.auto, self.cross = ldcorr(self.fname, self.na)
-
-	    self.nsb, self.na, self.nch, self.npt = self.auto.shape
-	    self.shapeLab.setText(repr(self.auto.shape))
-	    self.t0 = self.time - self.time[0]
-	    self.ch0 = np.array(range(nch))
-	    self.tlim = [self.t0[0], self.t0[-1]]
-	    self.tlimLE[0].setText('%.3f' % self.tlim[0])
-	    self.tlimLE[1].setText('%.3f' % self.tlim[1])
-	    self.tlimLab.setText('[%.3f, %.3f]' % tuple(self.tlim))
-	    self.bl = np.zeros((self.na-1, self.na), dtype=int)	# anti: 0, na-2; antj = 1, na-1
-	    b = 0
-	    for i in range(self.na-1):
-		for j in range(i+1, self.na):
-		    self.bl[i, j] = b
-		    b += 1
+	if (fname):
+	    self.startjob(partial(opendata, fname, self.na, self.cache), fname, self.loaded)
 
 	else:
 	    self.statusBar().showMessage("no file selected!", 2000)
 
 
+    def startjob(self, job, label, done):
+	# run job(report) in a Loader thread, then done(result) here; one job
+	# at a time. returns False if another one is running
+	if (self.loader is not None):
+	    self.statusBar().showMessage('busy loading %s' % self.loader.label, 2000)
+	    return False
+
+	self.loader = Loader(job, label, self)
+	self.loader.done = done
+	self.loader.progress.connect(self.loadprogress)
+	self.loader.loaded.connect(self.jobdone)
+	self.loader.failed.connect(self.loadfailed)
+	self.loadBar.setRange(0, 0)
+	self.loadBar.show()
+	self.cancelBtn.show()
+	self.statusBar().showMessage('loading %s' % label)
+	self.loader.start()
+	return True
+
+
+    def loadprogress(self, done, total, step):
+	self.loadBar.setRange(0, total)
+	self.loadBar.setValue(done)
+	self.statusBar().showMessage('loading %s: %s (%d/%d)' % (self.loader.label, step, done, total))
+
+
+    def cancelload(self):
+	if (self.loader is not None):
+	    self.loader.cancel()
+	    self.statusBar().showMessage('cancelling ...')
+
+
+    def loadfailed(self, msg):
+	print msg
+	self.loaddone()
+	self.statusBar().showMessage(msg, 5000)
+
+
+    def loaddone(self):
+	self.loader.wait()
+	self.loader = None
+	self.loadBar.hide()
+	self.cancelBtn.hide()
+
+
+    def jobdone(self, out):
+	done = self.loader.done
+	self.loaddone()
+	done(out)
+
+
+    def loaded(self, data):
+	# switch to the data of the Loader; what was kept of an older
+	# version of the file (grown or converted again) is dropped
+	if (self.reader is not None):
+	    self.reader.close()
+	self.cache.drop(data['fname'])
+	self.reader = data['reader']
+	self.fname = data['fname']
+	self.fileLab.setText(self.fname)
+	self.time = data['time']
+	self.tindex = data['tindex']
+	self.statusBar().showMessage('loaded %s' % self.fname, 2000)
+
+	self.nsb, self.na, self.nch, self.npt = data['shape']
+	self.shapeLab.setText(repr(data['shape']))
+	self.t0 = self.time - self.time[0]
+	self.ch0 = np.array(range(self.nch))
+	self.tlim = [self.t0[0], self.t0[-1]]
+	self.tlimLE[0].setText('%.3f' % self.tlim[0])
+	self.tlimLE[1].setText('%.3f' % self.tlim[1])
+	self.tlimLab.setText('[%.3f, %.3f]' % tuple(self.tlim))
+	self.bi = BaselineIndex(self.na)
+
+
     def updateSB(self):
 	self.sb = self.BGSB.checkedId()
 	print '(Usr) SB:', self.sb
@@ -824,7 +1032,12 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
 
 
-    def dataRebin(self):
+    def dataRebin(self, draw):
+	# self.plotData, ch1, t1 of the selection, then draw(); the baseline
+	# is read by a Loader thread (see rebinsel)
+	if (self.loader is not None):
+	    self.statusBar().showMessage('busy loading %s' % self.loader.label, 2000)
+	    return 1	# failed
 
 	if (self.verifyANT() == 0):
 	    print 'passed ANT:', self.anti, self.antj
@@ -859,52 +1072,78 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
 	self.selectBL = '%d-%d' % (self.anti, self.antj)
 
-	if (self.anti == self.antj):	# auto
-	    raw = self.auto[self.sb, self.anti]
-	    print 'auto'
-	else:				# cross
-	    b = self.bl[self.anti, self.antj]
-	    raw = self.cross[self.sb, b]
-	    print 'cross, b =', b
-	#print 'raw.shape', raw.shape
-
-        (M0, M1) = raw.shape	# = (nch, npt)
-	N0 = self.chbin
-	N1 = self.tbin
+	(M0, M1) = (self.nch, self.npt)
+	N0 = min(self.chbin, M0)
+	N1 = min(self.tbin, M1)
 	print 're-Bin:', N0, N1
 
-	# binned data
-	if (N0>1 or N1>1):	# re-bin
-	    N0 = min(N0, M0)
-	    N1 = min(N1, M1)
-	    nbin0 = M0 // N0
-	    nbin1 = M1 // N1
-	    self.plotData = raw[:(nbin0 * N0), :(nbin1 * N1)].reshape(nbin0, N0, nbin1, N1).mean(axis=(1,3))
-	    self.ch1 = self.ch0[:(nbin0 * N0)].reshape(nbin0, N0).mean(axis=1) 
-	    self.t1  = self.t0[:(nbin1 * N1)].reshape(nbin1, N1).mean(axis=1) 
-	else:			# raw-bin
-	    self.plotData = raw
-	    self.ch1 = self.ch0
-	    self.t1  = self.t0
+	# the product of the same selection and binning is reused from
+	# self.cache (e.g. vs-time then vs-chan of the same block)
+	key = self.reader.ckey + ('dataRebin', self.sb, self.anti, self.antj, N0, N1, tuple(self.chlim), tuple(self.tlim))
+
+	def rebinned(res):
+	    self.cache.put(key, res)
+	    (self.plotData, self.ch1, self.t1) = res
+	    draw()
+
+	if (key in self.cache):
+	    print 're-use', self.selectBL, 'binned'
+	    rebinned(self.cache.get(key, None))
+	    return 0	# success
+
+	job = partial(self.rebinsel, self.reader, self.sb, self.anti, self.antj, list(self.chlim), list(self.tlim), N0, N1)
+	if (not self.startjob(job, 'BL%s, SB%d' % (self.selectBL, self.sb), rebinned)):
+	    return 1	# failed
+
+	#print 're-bin started'
+	return 0	# success
+
+
+    def rebinsel(self, reader, sb, anti, antj, chlim, tlim, N0, N1, report):
+	# (plotData, ch1, t1) of a selection, binned N0 x N1 (run by a Loader)
+	# the bins of chlim/tlim are found first, then only these are read and
+	# averaged (the same bins as when binning the whole baseline)
+	sp = span('dataRebin', chbin=N0, tbin=N1)
+	(M0, M1) = (self.nch, self.npt)
+	nbin0 = M0 // N0
+	nbin1 = M1 // N1
+	binned = (N0>1 or N1>1)
 
 	# choose range
 	#w0 = np.logical_and(self.ch1 > self.chlim[0], self.ch1 < self.chlim[1])
 	#w1 = np.logical_and(self.t1 >= self.tlim[0], self.t1 <= self.tlim[1])
 	## note: we can not use self.plotData[w0, w1] to select range.
 	##       self.plotData[w0,:] or self.plotData[:,w1] would both be valid though
-	(w00, w01) = np.abs(self.ch1 - self.chlim[0]).argmin(), np.abs(self.ch1 - self.chlim[1]).argmin()
-	(w10, w11) = np.abs(self.t1 - self.tlim[0]).argmin(),   np.abs(self.t1 - self.tlim[1]).argmin()
-	#print self.chlim, self.ch1
-	#print self.tlim, self.t1
+	if (binned):
+	    ch1 = self.ch0[:(nbin0 * N0)].reshape(nbin0, N0).mean(axis=1) 
+	else:
+	    ch1 = self.ch0
+	(w00, w01) = np.abs(ch1 - chlim[0]).argmin(), np.abs(ch1 - chlim[1]).argmin()
+	# time: the integration nearest to tlim (time index), then its bin
+	(w10, w11) = [min(self.tindex.index(self.time[0] + t) // N1, nbin1 - 1) for t in tlim]
 	#print 'ch range:', w00, w01
 	#print 'pt range:', w10, w11
-	self.plotData = self.plotData[w00:w01+1, w10:w11+1]
-	self.ch1 = self.ch1[w00:w01+1]
-	self.t1  = self.t1[w10:w11+1]
-	
-
-	#print 're-bin successful'
-	return 0	# success
+	(cr, tr) = ([w00 * N0, (w01+1) * N0], [w10 * N1, (w11+1) * N1])
+
+	# read the selected range of the baseline only (or a recently used
+	# one from self.cache), binned from the pyramid if there is one; in
+	# blocks of whole time bins of about readmem, for progress and cancel
+	tb = max(1, readmem // (16 * (cr[1] - cr[0]) * N1)) * N1
+	blocks = range(tr[0], tr[1], tb)
+	parts = []
+	for (k, t) in enumerate(blocks):
+	    report(k, len(blocks), 'read')
+	    parts.append(reader.visbin(sb, anti, antj, N0, N1, cr, [t, min(t + tb, tr[1])]))
+	report(len(blocks), len(blocks), 'read')
+	plotData = np.concatenate(parts, axis=1)
+	print 'read %d-%d' % (anti, antj), 'from', reader.fname, '(cache: %s)' % self.cache.stats()
+
+	ch1 = ch1[w00:w01+1]
+	t1  = self.t0[tr[0]:tr[1]]
+	if (binned):		# re-bin
+	    t1 = t1.reshape(w11 - w10 + 1, N1).mean(axis=1)
+	sp.close(plotData.nbytes)
+	return (plotData, ch1, t1)
 
 
     def update_ampplot(self):
@@ -944,19 +1183,17 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
 
     def newplotvstime(self):
-	self.plot.clear()
-	self.plotvstime()
-	self.plot.update_info('amp', title=self.fname, xlabel='Time (sec)', ylabel='Amplitude')
-	self.plot.update_info('pha', title=self.fname, xlabel='Time (sec)', ylabel='Phase (rad)')
+	self.rebinplot(self.drawvstime, True)
 
 
     def plotvstime(self):
-	if (self.dataRebin() == 0):
-	    pass
-	else:
-	    self.statusBar().showMessage('Data re-bin error. Abort!', 2000)
-	    return None
+	self.rebinplot(self.drawvstime, False)
+
 
+    def drawvstime(self, new):
+	if (new):
+	    self.plot.clear()
+	sp = span('plot', npt=self.plotData.shape[1])
 	x = self.t1
 	a = np.abs(self.plotData.mean(axis=0))
 	p = np.angle(self.plotData.mean(axis=0))
@@ -964,23 +1201,25 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 	label = 'BL%s, SB%d' % (self.selectBL, self.sb)
 	self.plot.add_trace('amp', x, a, label=label)
 	self.plot.add_trace('pha', x, p, label=label)
+	sp.close()
+	if (new):
+	    self.plot.update_info('amp', title=self.fname, xlabel='Time (sec)', ylabel='Amplitude')
+	    self.plot.update_info('pha', title=self.fname, xlabel='Time (sec)', ylabel='Phase (rad)')
 
 
 
     def newplotvschan(self):
-	self.plot.clear()
-	self.plotvschan()
-	self.plot.update_info('amp', title=self.fname, xlabel='Channel (ch)', ylabel='Amplitude')
-	self.plot.update_info('pha', title=self.fname, xlabel='Channel (ch)', ylabel='Phase (rad)')
+	self.rebinplot(self.drawvschan, True)
 
 
     def plotvschan(self):
-	if (self.dataRebin() == 0):
-	    pass
-	else:
-	    self.statusBar().showMessage('Data re-bin error. Abort!', 2000)
-	    return None
+	self.rebinplot(self.drawvschan, False)
+
 
+    def drawvschan(self, new):
+	if (new):
+	    self.plot.clear()
+	sp = span('plot', npt=self.plotData.shape[0])
 	x = self.ch1
 	a = np.abs(self.plotData.mean(axis=1))
 	p = np.angle(self.plotData.mean(axis=1))
@@ -988,6 +1227,17 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 	label = 'BL%s, SB%d' % (self.selectBL, self.sb)
 	self.plot.add_trace('amp', x, a, label=label)
 	self.plot.add_trace('pha', x, p, label=label)
+	sp.close()
+	if (new):
+	    self.plot.update_info('amp', title=self.fname, xlabel='Channel (ch)', ylabel='Amplitude')
+	    self.plot.update_info('pha', title=self.fname, xlabel='Channel (ch)', ylabel='Phase (rad)')
+
+
+    def rebinplot(self, draw, new):
+	# draw(new) once the selection is read and binned (see dataRebin);
+	# new: clear the plot first
+	if (self.dataRebin(partial(draw, new)) != 0):
+	    self.statusBar().showMessage('Data re-bin error. Abort!', 2000)
 
 
     def savefig(self):
@@ -1003,6 +1253,11 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.close()
 
     def closeEvent(self, ce):
+	if (self.loader is not None):
+	    self.loader.cancel()
+	    self.loader.wait()
+	if (self.reader is not None):
+	    self.reader.close()
         self.fileQuit()
 
     def about(self):
@@ -1015,7 +1270,7 @@ This data viewer is intended for the 1k channel digital correlator of the AIM-CO
 
 if (__name__ == '__main__'):
 
-    inp = sys.argv[0:]
+    inp = ytlatrace.argv(sys.argv[0:])
 
     qApp = QtWidgets.QApplication(inp)
 
@@ -1024,12 +1279,15 @@ if (__name__ == '__main__'):
     bindir   = os.path.dirname(pg)
 
     fname = ''
+    cachemem = None
     while (inp):
 	f = inp.pop(0)
-	if os.path.isfile(f):
+	if (f == '-mem'):		# memory budget of the baseline cache (MB)
+	    cachemem = int(float(inp.pop(0)) * 1024**2)
+	elif os.path.isfile(f):
 	    fname = f
 
-    aw = ApplicationWindow(fname=fname, bindir=bindir)
+    aw = ApplicationWindow(fname=fname, bindir=bindir, cachemem=cachemem)
     aw.setWindowTitle("%s" % progname)
     aw.show()
 
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+import numpy as np
+import h5py
+import sys, os, os.path
+import time as systime
+import tempfile, shutil
+from datetime import datetime
+from loadh5 import *
+import blockreduce
+
+
+# compression ratio vs. speed of the HDF5 filters on a sample of a oneh5
+# file: every candidate is written to and read back from an in-memory
+# HDF5 file (core driver), so only the filter cost is timed, with the
+# chunks of crtoneh5. the candidates are the available ones of
+#	none, lzf, gzip 1/4/6/9, each with and without shuffle
+#	scale-offset (auto only, lossy: decimal digits kept)
+# the recommended lossless setting is the one with the shortest time to
+# read the data from a disk of the given speed (size / ratio / disk +
+# size / read rate); it is written to the converter's configuration
+# (loadh5.h5config, see ldconfig).
+
+samplemem = 64 * 1024**2	# max. size of the sample of each dataset (bytes)
+
+
+def candidates(xtype, lossy=(3, 5)):
+	# [(name, crtoneh5 options), ...] of the filters available here;
+	# lossy: decimal digits of the scale-offset candidates (auto only)
+	z = h5py.h5z
+	out = [('none', {'compression': None, 'shuffle': False})]
+	for shuffle in [False, True]:
+		tag = '+shuffle' if (shuffle) else ''
+		if (z.filter_avail(z.FILTER_LZF)):
+			out.append(('lzf' + tag, {'compression': 'lzf', 'shuffle': shuffle}))
+		if (z.filter_avail(z.FILTER_DEFLATE)):
+			for lev in [1, 4, 6, 9]:
+				out.append(('gzip%d%s' % (lev, tag), {'compression': 'gzip', 'clevel': lev, 'shuffle': shuffle}))
+	if (xtype == 'auto' and z.filter_avail(z.FILTER_SCALEOFFSET)):
+		for dig in lossy:
+			out.append(('scaleoffset%d' % dig, {'compression': None, 'shuffle': False, 'scaleoffset': dig}))
+	return out
+
+
+def sample(h5name, mem=None):
+	# {'auto': .., 'cross': ..} the first integrations of h5name, at most
+	# mem bytes (default samplemem) each
+	if (mem is None):
+		mem = samplemem
+	out = {}
+	with OneH5Reader(h5name, server=False) as r:
+		for (xtype, n, dtype) in [('auto', r.na, r.adtype), ('cross', r.nb, r.cdtype)]:
+			nt = blockreduce.tblocksize((r.nsb, n, r.nch, r.ndata), dtype, mem)
+			out[xtype] = r.block(xtype, None, [0, nt])
+	return out
+
+
+def trial(data, opts, nrep=2):
+	# write data with the crtoneh5 options opts to an in-memory file and
+	# read it back; returns (ratio, write MB/s, read MB/s, max. error)
+	# (best of nrep; the error is relative to max |data|)
+	(nsb, n, nc, nt) = data.shape
+	dopts = dsopts(nc, nt, **opts)
+	if (opts.get('scaleoffset') is not None):
+		dopts['scaleoffset'] = opts['scaleoffset']
+	mb = data.nbytes / 1048576.
+	(tw, tr) = (np.inf, np.inf)
+	for k in range(nrep):
+		f = h5py.File('trial%d.h5' % k, 'w', driver='core', backing_store=False)
+		t = systime.time()
+		d = f.create_dataset('x', data.shape, dtype=data.dtype, **dopts)
+		d[...] = data
+		f.flush()
+		tw = min(tw, systime.time() - t)
+		size = d.id.get_storage_size()
+		t = systime.time()
+		back = d[...]
+		tr = min(tr, systime.time() - t)
+		f.close()
+	err = np.abs(back - data).max() / max(np.abs(data).max(), 1e-300)
+	return (data.nbytes / float(max(size, 1)), mb / max(tw, 1e-9), mb / max(tr, 1e-9), err)
+
+
+def bench(data, lossy=(3, 5)):
+	# {xtype: [(name, opts, ratio, write MB/s, read MB/s, err), ...]}
+	res = {}
+	for xtype in ['auto', 'cross']:
+		res[xtype] = []
+		for (name, opts) in candidates(xtype, lossy):
+			res[xtype].append((name, opts) + trial(data[xtype], opts))
+	return res
+
+
+def _cost(r, disk):
+	# seconds per MB to read with the result r of bench from a disk of
+	# disk MB/s: reading the compressed data, then decoding it
+	return 1. / (disk * r[2]) + 1. / r[4]
+
+
+def recommend(res, mb, disk=200., maxerr=0.):
+	# the crtoneh5 options of the shortest read time of auto and cross
+	# together (mb = {xtype: MB of the data}, the weights) from a disk of
+	# disk MB/s. only candidates with an error up to maxerr are taken
+	# (lossless by default); auto gets the scale-offset filter when it
+	# qualifies and reads fastest
+	best = None
+	for rc in res['cross']:
+		ra = [r for r in res['auto'] if (r[0] == rc[0])]
+		if (rc[5] > maxerr or not ra or ra[0][5] > maxerr):
+			continue
+		c = mb['cross'] * _cost(rc, disk) + mb['auto'] * _cost(ra[0], disk)
+		if (best is None or c < best[0]):
+			best = (c, rc)
+	opts = dict(best[1][1])
+
+	ok = [r for r in res['auto'] if (r[5] <= maxerr)]
+	abest = min(ok, key=lambda r: _cost(r, disk))
+	if (abest[1].get('scaleoffset') is not None):
+		opts['scaleoffset'] = abest[1]['scaleoffset']
+	return opts
+
+
+def wtconfig(opts, fname, source=''):
+	# write the crtoneh5 options opts as the configuration fname
+	with open(fname, 'w') as f:
+		print >> f, '# storage defaults of crtoneh5 (see loadh5.ldconfig)'
+		print >> f, '# written by h5filter_bench.py on %s' % datetime.now().isoformat()
+		if (source):
+			print >> f, '# sample: %s' % source
+		for k in ['compression', 'clevel', 'shuffle', 'scaleoffset']:
+			if (k in opts):
+				v = opts[k]
+				if (isinstance(v, bool)):
+					v = int(v)
+				print >> f, '%-12s %s' % (k, 'none' if (v is None) else v)
+
+
+
+if (__name__ == '__main__'):
+
+    inp = sys.argv[0:]
+    pg  = inp.pop(0)
+    usage = '''
+    compression ratio and write/read speed of the HDF5 filters on a sample
+    of a oneh5 file (or of synthetic data); the recommended setting is
+    written to the converter's configuration (%s)
+
+    %s <oneh5> [options]
+    %s -synth [options]
+
+	options are:
+	-mb N		# sample size per dataset in MB (default %d)
+	-disk MB/s	# disk read speed for the recommendation (default 200)
+	-lossy maxerr	# allow the scale-offset filter on auto, if its max.
+			# error relative to max |auto| is below maxerr
+	-config file	# configuration to write (default %s,
+			# or the environment variable YTLA_H5CONFIG)
+	-nowrite	# only report
+
+    ''' % (h5config, pg, pg, samplemem / 1048576, h5config)
+
+    if (len(inp) < 1):
+	print usage
+	sys.exit()
+
+    fname = None
+    synth = False
+    disk = 200.
+    maxerr = 0.
+    fconf = h5config
+    write = True
+    while (inp):
+	arg = inp.pop(0)
+	try:
+	    if (arg == '-synth'):
+		synth = True
+	    elif (arg == '-mb'):
+		samplemem = int(float(inp.pop(0)) * 1048576)
+	    elif (arg == '-disk'):
+		disk = float(inp.pop(0))
+	    elif (arg == '-lossy'):
+		maxerr = float(inp.pop(0))
+	    elif (arg == '-config'):
+		fconf = inp.pop(0)
+	    elif (arg == '-nowrite'):
+		write = False
+	    elif (arg.startswith('-')):
+		print 'unknown option:', arg
+	    else:
+		fname = arg
+	except (ValueError, IndexError):
+	    print 'error reading option:', arg
+
+    tmpdir = None
+    if (synth):
+	import mksynth
+	tmpdir = tempfile.mkdtemp(prefix='h5filter_bench.')
+	fbase = os.path.join(tmpdir, 'synth')
+	mksynth.synth(fbase, 7, nch, 1000)
+	fname = fbase + '.raw.oneh5'
+	cvcorr(fbase, 7, fname, summary=None, compression=None)
+    if (fname is None):
+	print usage
+	sys.exit()
+
+    try:
+	print 'sample of', fname
+	data = sample(fname)
+	res = bench(data)
+    finally:
+	if (tmpdir is not None):
+	    shutil.rmtree(tmpdir)
+
+    for xtype in ['auto', 'cross']:
+	d = data[xtype]
+	print '\n%s %s %s, %.1f MB' % (xtype, d.shape, d.dtype, d.nbytes / 1048576.)
+	print '%-18s %7s %10s %10s %9s' % ('filter', 'ratio', 'wrt(MB/s)', 'read(MB/s)', 'max.err')
+	for r in res[xtype]:
+	    print '%-18s %7.2f %10.1f %10.1f %9.1e' % (r[0], r[2], r[3], r[4], r[5])
+
+    opts = recommend(res, dict([(k, data[k].nbytes / 1048576.) for k in data]), disk, maxerr)
+    print '\nrecommended (disk %.0f MB/s):' % disk, ', '.join(['%s=%s' % (k, opts[k]) for k in sorted(opts)])
+    if (write):
+	wtconfig(opts, fconf, 'synthetic' if (synth) else os.path.abspath(fname))
+	print 'written to', fconf
@@ -2,101 +2,524 @@
 import numpy as np
 import h5py
 import sys, os.path
-from datetime import datetime
+from collections import OrderedDict
+import ytlatrace
+from ytlatrace import span
+from visdata import BaselineIndex
+from blockreduce import blkreduce
 
 nsb = 2		# fixed num. of sidebands ('lsb', 'usb')
 nch = 1024	# fixed num. of channels
+oneh5_version = 3	# layout written by wtoneh5; v2 = chunked per baseline,
+			# optionally compressed; v3 = timestamps may be stored
+			# compact (group 'timeindex'). v1 files (contiguous) have
+			# no 'version' attr and are still readable.
+sumch = [20, 760]	# channel range of the channel averages of plot_oneh5
+sefdch = [20, 740]	# channel range of the SEFD (track2sefd, bw)
+sumchs = [sumch, sefdch]	# ranges of the stored channel averages (smoneh5)
+tstol = 5e-4		# max. error of the compact timestamps (s), half the
+			# 1 ms resolution of the .timestamp files
+prectype = {		# storage/loading precision --> (auto, cross) dtypes
+	'double': (np.float64, np.complex128),
+	'single': (np.float32, np.complex64),
+}
+h5config = os.environ.get('YTLA_H5CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'oneh5.config'))
+			# storage defaults of crtoneh5 (see ldconfig): next to
+			# loadh5.py, or the environment variable YTLA_H5CONFIG
+cachemem = 512 * 1024**2	# default memory budget of a SliceCache (bytes)
 
 
 
-def ldcorr(fname, na):
-    nb = na * (na-1) / 2
+sbname = ['lsb', 'usb']
 
-    if (fname.endswith('.')):
-	fname.rstrip('.')
-    elif (fname.endswith('.timestamp')):
-	fname.rstrip('.timestamp')
 
-    ftime = fname + '.timestamp'
+def corrname(fbase, s, xtype):
+	# name of the correlator file of sideband s, xtype = 'auto' or 'cross'
+	return fbase + '.%s.%s.h5' % (sbname[s], xtype)
 
-    if (os.path.isfile(ftime)):
-	print 'use existing .timestamp file'
-    else:
-	print 'no existing .timestamp file'
-	print 'will use ad hoc time info (1 sec/pt)'
 
-    dname = os.path.dirname(fname)
-    if (dname == ''):
-	dname = '.'
-    fbase = fname
+def corrsrc(fname):
+	# locate the correlator files of an observation
+	# fname is the file base (e.g. './data/2017_Oct_26_03_35_27.ytla')
+	# or its .timestamp file
+	# returns (fbase, nch, ndata, time)
+	if (fname.endswith('.timestamp')):
+		fname = fname[:-len('.timestamp')]
+	fbase = fname.rstrip('.')
+	ftime = fbase + '.timestamp'
+
+	#-- determine data length --
+	with h5py.File(corrname(fbase, 0, 'auto'), 'r') as ha:
+		(nch, ndata) = ha['auto00'].shape
 
+	if (os.path.isfile(ftime)):
+		print 'use existing .timestamp file'
+		time = np.loadtxt(ftime)
+	else:
+		print 'no existing .timestamp file'
+		print 'will use ad hoc time info (1 sec/pt)'
+		time = np.arange(ndata)
 
-    print '... ', datetime.now().isoformat()
+	return fbase, nch, ndata, time
 
 
-    #-- determine data length --
-    aname = dname + '/' + fbase + '.%s.%s.h5' % ('lsb', 'auto')
-    ha = h5py.File(aname, 'r')
-    bname = 'auto%d%d' % (0, 0)
-    arr = np.array(ha.get(bname))
-    (nch, ndata) = arr.shape
-    ha.close()
+def ldcorr(fname, na, precision='double'):
+    # precision = 'double' or 'single' (float32/complex64, half the memory)
+    nb = na * (na-1) / 2
+    (adtype, cdtype) = prectype[precision]
 
-    #-- load data --
-    if (os.path.isfile(ftime)):
-	time = np.loadtxt(ftime)
-    else:
-	time = np.arange(ndata)
-    
+    (fbase, nch, ndata, time) = corrsrc(fname)
 
-    w = ['lsb', 'usb']
-    auto  = np.zeros((nsb, na, nch, ndata))
-    cross = np.zeros((nsb, nb, nch, ndata), dtype=complex)
+    sp = span('read corr', file=fbase)
+
+    #-- load data --
+    auto  = np.zeros((nsb, na, nch, ndata), dtype=adtype)
+    cross = np.zeros((nsb, nb, nch, ndata), dtype=cdtype)
     for s in range(nsb):
 	b = -1
 
-	xtype = 'auto'
-	aname = dname + '/' + fbase + '.%s.%s.h5' % (w[s], xtype)
+	aname = corrname(fbase, s, 'auto')
 	print aname, '--> ', os.path.isfile(aname)
-	ha = h5py.File(aname, 'r')
-	xtype = 'cross'
-	cname = dname + '/' + fbase + '.%s.%s.h5' % (w[s], xtype)
+	cname = corrname(fbase, s, 'cross')
 	print cname, '--> ', os.path.isfile(cname)
-	hc = h5py.File(cname, 'r')
-
-	for i in range(na):
-	    bname = 'auto%d%d' % (i, i)
-	    arr = np.array(ha.get(bname))
-	    auto[s, i] = arr
-		    
-	    for j in range(i+1, na):
-		b += 1
-		bname = '/cross%d%d' % (i, j)
-		arr = np.array(hc.get('%s/real' % bname))
-		cross[s, b].real = arr
-		arr = np.array(hc.get('%s/imag' % bname))
-		cross[s, b].imag = arr
-
-	ha.close()
-	hc.close()
-
-    print '... ', datetime.now().isoformat()
+	with h5py.File(aname, 'r') as ha, h5py.File(cname, 'r') as hc:
+	    for i in range(na):
+		bname = 'auto%d%d' % (i, i)
+		auto[s, i] = ha[bname][...]
+
+		for j in range(i+1, na):
+		    b += 1
+		    bname = 'cross%d%d' % (i, j)
+		    cross[s, b].real = hc['%s/real' % bname][...]
+		    cross[s, b].imag = hc['%s/imag' % bname][...]
+
+    sp.close(auto.nbytes + cross.nbytes)
     return time, auto, cross
 
 
-def wtoneh5(h5name, time, auto, cross):
-	# write out the full dataset into an All-in-One h5 file
-	print '... ', datetime.now().isoformat()
+_cvfiles = {}	# source files kept open by _cvread (per process)
+
+def _cvread(task):
+	# read one block of one correlator dataset; task is
+	# (fname, dname, dslot, t0, t1) with dslot = ('auto'|'cross', s, i|b)
+	(fname, dname, dslot, t0, t1) = task
+	if (not fname in _cvfiles):
+		_cvfiles[fname] = h5py.File(fname, 'r')
+	h = _cvfiles[fname]
+
+	if (dslot[0] == 'auto'):
+		blk = h[dname][:, t0:t1]
+	else:
+		sre = h[dname + '/real']
+		# complex of the correlator's precision
+		blk = np.empty((sre.shape[0], t1-t0), dtype=np.result_type(sre.dtype, np.complex64))
+		blk.real = sre[:, t0:t1]
+		blk.imag = h[dname + '/imag'][:, t0:t1]
+
+	return dslot, t0, t1, blk
+
+
+def _cvclose():
+	for fname in _cvfiles.keys():
+		_cvfiles.pop(fname).close()
+
+
+def cvcorr(fname, na, h5name, **kwargs):
+	# convert the correlator files into an All-in-One h5 file without
+	# loading the full cube: every autoNN and crossIJ/real|imag dataset is
+	# copied into its slot of the output, tblock integrations at a time
+	#
+	# options:
+	#	tblock		integrations per copied block (default 1024)
+	#	nproc		number of reader processes (default 1, no pool);
+	#			blocks are read concurrently and written by
+	#			this process only
+	#	summary		channel range(s) of the stored summary products
+	#			(default sumchs, None = no summary; see smoneh5)
+	#	(others are passed to crtoneh5)
+	tblock = kwargs.pop('tblock', 1024)
+	nproc  = kwargs.pop('nproc', 1)
+	summary = kwargs.pop('summary', sumchs)
+
+	(fbase, nch, ndata, time) = corrsrc(fname)
+	if (len(time) != ndata):
+		print 'warning: %d timestamps for %d integrations' % (len(time), ndata)
+		ndata = min(ndata, len(time))
+		time  = time[:ndata]
+
+	sp = span('convert', file=h5name)
+
+	tasks = _cvtasks(fbase, na, 0, ndata, tblock)
+
+	# the pool is started before the output file is opened
+	if (nproc > 1):
+		import multiprocessing
+		pool = multiprocessing.Pool(nproc)
+	else:
+		pool = None
+
+	f = crtoneh5(h5name, time, na, nch, ndata, **kwargs)
+	if (f is None):
+		if (pool is not None):
+			pool.terminate()
+		sp.close()
+		return None
+
+	_cvcopy(f, tasks, pool, nproc)
+	f.close()
+
+	if (summary is not None):
+		smoneh5(h5name, summary)
+
+	sp.close()
+
+
+def _cvtasks(fbase, na, n0, n1, tblock):
+	# one task per (dataset, block) for integrations [n0, n1)
+	tasks = []
+	for s in range(nsb):
+		aname = corrname(fbase, s, 'auto')
+		cname = corrname(fbase, s, 'cross')
+		print aname, cname
+
+		b = -1
+		for i in range(na):
+			for t0 in range(n0, n1, tblock):
+				t1 = min(t0 + tblock, n1)
+				tasks.append((aname, 'auto%d%d' % (i, i), ('auto', s, i), t0, t1))
+
+			for j in range(i+1, na):
+				b += 1
+				for t0 in range(n0, n1, tblock):
+					t1 = min(t0 + tblock, n1)
+					tasks.append((cname, 'cross%d%d' % (i, j), ('cross', s, b), t0, t1))
+
+	return tasks
+
+
+def _cvcopy(f, tasks, pool=None, nproc=1):
+	# read the task blocks (on the pool of nproc processes, if given)
+	# and write them into f
+	sp = span('copy blocks', nproc=nproc)
+	if (pool is not None):
+		# submit a few blocks per worker at a time to bound the memory
+		nwin = 4 * nproc
+		for w in range(0, len(tasks), nwin):
+			for (dslot, t0, t1, blk) in pool.imap_unordered(_cvread, tasks[w:w+nwin]):
+				f[dslot[0]][dslot[1], dslot[2], :, t0:t1] = blk
+				sp.add(blk.nbytes)
+		pool.close()
+		pool.join()
+	else:
+		for task in tasks:
+			(dslot, t0, t1, blk) = _cvread(task)
+			f[dslot[0]][dslot[1], dslot[2], :, t0:t1] = blk
+			sp.add(blk.nbytes)
+		_cvclose()
+	sp.close()
+
+
+def tloneh5(fname, na, h5name, **kwargs):
+	# incremental (tail) conversion while the correlator is still writing:
+	# only the integrations that are new since the last call are copied,
+	# the resizable timestamp/auto/cross datasets of h5name are extended.
+	# the .timestamp file is read from where the last call stopped
+	# (attrs 'ts_offset', 'ts_count'); without it, ad hoc time is used
+	# until it shows up.
+	# returns the number of new integrations (None on error)
+	#
+	# options: tblock, nproc as in cvcorr; others are passed to crtoneh5
+	tblock = kwargs.pop('tblock', 1024)
+	nproc  = kwargs.pop('nproc', 1)
+	kwargs.pop('summary', None)	# summaries are not kept up to date while growing
+
+	if (fname.endswith('.timestamp')):
+		fname = fname[:-len('.timestamp')]
+	fbase = fname.rstrip('.')
+	ftime = fbase + '.timestamp'
+
+	#-- integrations available in all correlator files --
+	nsrc = None
+	for s in range(nsb):
+		with h5py.File(corrname(fbase, s, 'auto'), 'r') as ha:
+			for i in range(na):
+				(nch, n) = ha['auto%d%d' % (i, i)].shape
+				nsrc = n if (nsrc is None) else min(nsrc, n)
+		with h5py.File(corrname(fbase, s, 'cross'), 'r') as hc:
+			for i in range(na):
+				for j in range(i+1, na):
+					for part in ['real', 'imag']:
+						n = hc['cross%d%d/%s' % (i, j, part)].shape[1]
+						nsrc = min(nsrc, n)
+
+	if (not os.path.isfile(h5name)):
+		f = crtoneh5(h5name, np.zeros(0), na, nch, 0, grow=True, **kwargs)
+		if (f is None):
+			return None
+		f.attrs['ts_offset'] = 0
+		f.attrs['ts_count']  = 0
+		f.close()
+
+	with h5py.File(h5name, 'r') as f:
+		if (f['auto'].maxshape[3] is not None):
+			print 'error: %s is not resizable (not written by tloneh5)' % h5name
+			return None
+		n0 = f['auto'].shape[3]
+		ts_offset = int(f.attrs['ts_offset'])
+		ts_count  = int(f.attrs['ts_count'])
+
+	#-- new timestamps (complete lines only) --
+	if (os.path.isfile(ftime)):
+		with open(ftime, 'r') as ft:
+			ft.seek(ts_offset)
+			lines = ft.read().split('\n')[:-1]	# last one is incomplete
+		n1 = min(nsrc, ts_count + len(lines))
+		lines = lines[:max(0, n1 - ts_count)]
+		newts = np.array([float(l) for l in lines])
+	else:
+		n1 = nsrc
+		newts = None
+
+	# the pool is started before the output file is opened
+	if (nproc > 1 and n1 > n0):
+		import multiprocessing
+		pool = multiprocessing.Pool(nproc)
+	else:
+		pool = None
+
+	sp = span('tail', file=h5name)
+	f = h5py.File(h5name, 'a')
+	if (n1 > n0):
+		for dname in ['timestamp', 'auto', 'cross']:
+			d = f[dname]
+			d.resize(n1, axis=d.ndim-1)
+
+		_cvcopy(f, _cvtasks(fbase, na, n0, n1, tblock), pool, nproc)
+		f.attrs['ndata'] = n1
+
+	# ad hoc time until the .timestamp file covers the data
+	if (newts is None):
+		if (n1 > n0):
+			f['timestamp'][n0:n1] = np.arange(n0, n1)
+	elif (len(newts) > 0):
+		f['timestamp'][ts_count:ts_count+len(newts)] = newts
+		f.attrs['ts_count']  = ts_count + len(newts)
+		f.attrs['ts_offset'] = ts_offset + sum([len(l)+1 for l in lines])
+
+	f.close()
+	sp.close()
+
+	print '... %s: %d new integrations (%d total)' % (h5name, max(0, n1-n0), max(n0, n1))
+	return max(0, n1-n0)
+
+
+class TimeIndex(object):
+    # time <--> integration index of an observation
+    # the timestamps are modelled as regular segments sharing the step dt:
+    # integration i of segment k (seg_i[k] <= i < seg_i[k+1]) is at
+    #	seg_t[k] + (i - seg_i[k]) * dt
+    # regular sampling is a single segment (t0, dt); every gap or jump
+    # starts a new one (the exception list). a time lookup is then O(1)
+    # for one segment, O(log nseg) otherwise.
+    # given the full array (time), lookups use it instead (O(log n))
+
+    def __init__(self, n, dt=0., seg_i=None, seg_t=None, time=None):
+	self.n = n
+	self.dt = dt
+	self.seg_i = np.zeros(0, dtype=np.int64) if (seg_i is None) else np.asarray(seg_i, dtype=np.int64)
+	self.seg_t = np.zeros(0) if (seg_t is None) else np.asarray(seg_t, dtype=np.float64)
+	self.time = time
 
-	s = auto.shape
-	#nsb	= s[0]	# already determined
-	na	= s[1]
-	# nch	= s[2]	# already determined
-	ndata	= s[3]
+
+    def times(self, trange=None):
+	# the timestamps of integrations [trange[0], trange[1])
+	(i0, i1) = (0, self.n) if (trange is None) else (int(trange[0]), int(trange[1]))
+	if (self.time is not None):
+	    return self.time[i0:i1]
+	i = np.arange(i0, i1)
+	k = np.searchsorted(self.seg_i, i, side='right') - 1
+	return self.seg_t[k] + (i - self.seg_i[k]) * self.dt
+
+
+    def _count(self, t, side):
+	# number of integrations before t ('left') or up to t ('right')
+	if (self.time is not None):
+	    return int(np.searchsorted(self.time, t, side=side))
+	if (self.n == 0 or t < self.seg_t[0]):
+	    return 0
+	k = 0
+	if (len(self.seg_t) > 1):
+	    k = int(np.searchsorted(self.seg_t, t, side='right')) - 1
+	i0 = self.seg_i[k]
+	i1 = self.seg_i[k+1] if (k+1 < len(self.seg_i)) else self.n
+	x = (t - self.seg_t[k]) / self.dt if (self.dt > 0) else 0.
+	if (side == 'left'):
+	    m = int(np.ceil(x - 1e-9))
+	else:
+	    m = int(np.floor(x + 1e-9)) + 1
+	return int(min(i0 + max(m, 0), i1))
+
+
+    def range(self, tlim=None):
+	# [i0, i1), the integrations with tlim[0] <= time <= tlim[1]
+	if (tlim is None):
+	    return [0, self.n]
+	i0 = self._count(tlim[0], 'left')
+	i1 = self._count(tlim[1], 'right')
+	return [i0, max(i0, i1)]
+
+
+    def index(self, t):
+	# the integration nearest to time t
+	if (self.n < 2):
+	    return 0
+	i = min(max(self._count(t, 'left'), 1), self.n-1)
+	(tb, ta) = self.times([i-1, i+1])
+	return i-1 if (t - tb <= ta - t) else i
+
+
+def tsmodel(time, tol=None):
+	# fit the segment model of TimeIndex to time, every point within tol
+	# (default: tstol) of the model; None if it is not more compact
+	if (tol is None):
+		tol = tstol
+	time = np.asarray(time, dtype=np.float64)
+	n = len(time)
+	if (n < 2):
+		return TimeIndex(n, 0., range(n), time)
+	d = np.diff(time)
+
+	# candidate segments break where the step is not the typical one; dt
+	# is then the least-squares step of these runs (the median step is off
+	# by the rounding of the large timestamps, which adds up over a run)
+	edge = list(np.nonzero(np.abs(d - np.median(d)) > tol)[0] + 1) + [n]
+	(sxy, sxx) = (0., 0.)
+	i0 = 0
+	for i1 in edge:
+	    x = np.arange(i1 - i0) - (i1 - i0 - 1) / 2.
+	    y = time[i0:i1] - time[i0]
+	    sxy += np.dot(x, y - y.mean())
+	    sxx += np.dot(x, x)
+	    i0 = i1
+	dt = sxy / sxx if (sxx > 0) else np.median(d)
+
+	# each run is then split further if the drift from t0 + i*dt exceeds
+	# tol; the segment starts t0 are exact
+	seg_i = []
+	i0 = 0
+	for i1 in edge:
+	    while (i0 < i1):
+		err = np.abs(time[i0:i1] - (time[i0] + np.arange(i1 - i0) * dt))
+		bad = np.nonzero(err > tol)[0]
+		seg_i.append(i0)
+		i0 = i0 + bad[0] if (len(bad)) else i1
+	    if (len(seg_i) > n // 4):
+		return None
+	return TimeIndex(n, dt, seg_i, time[seg_i])
+
+
+def ldtindex(f):
+	# the TimeIndex of an open oneh5 file (or pyramid group)
+	if ('timestamp' in f):
+		return TimeIndex(f['timestamp'].shape[0], time=f['timestamp'][...])
+	g = f['timeindex']
+	return TimeIndex(g.attrs['ndata'], g.attrs['dt'], g['seg_i'][...], g['seg_t'][...])
+
+
+def _ldtime(f):
+	# the timestamps of an open oneh5 file, full or compact
+	return ldtindex(f).times()
+
+
+def _wttime(f, time, compact=False, grow=False):
+	# store time in 'timestamp' (resizable when grow), or compact in
+	# group 'timeindex' (attrs ndata, dt; datasets seg_i, seg_t) when
+	# the sampling is regular enough (lossy: within tstol)
+	ti = tsmodel(time) if (compact and not grow) else None
+	if (ti is None):
+		if (grow):
+			f.create_dataset('timestamp', data = time, maxshape = (None,))
+		else:
+			f.create_dataset('timestamp', data = time)
+		return
+	g = f.create_group('timeindex')
+	g.attrs['ndata'] = ti.n
+	g.attrs['dt'] = ti.dt
+	g.attrs['tol'] = tstol
+	g.create_dataset('seg_i', data = ti.seg_i)
+	g.create_dataset('seg_t', data = ti.seg_t)
+
+
+def ldconfig(fname=None):
+	# the storage defaults of crtoneh5 from fname (default h5config, the
+	# same whatever the current directory), e.g. as written by
+	# h5filter_bench.py:
+	#	# comment
+	#	compression	gzip
+	#	clevel		1
+	# one 'option value' per line; options tchunk, chchunk, compression,
+	# clevel, shuffle and scaleoffset; {} if there is no file
+	if (fname is None):
+		fname = h5config
+	conf = {}
+	if (not os.path.isfile(fname)):
+		return conf
+	with open(fname) as f:
+		for line in f:
+			w = line.split('#')[0].split()
+			if (len(w) < 2):
+				continue
+			(k, v) = (w[0], w[1])
+			try:
+				if (k in ['tchunk', 'chchunk', 'clevel', 'scaleoffset']):
+					conf[k] = int(v)
+				elif (k == 'shuffle'):
+					conf[k] = v.lower() in ['1', 'true', 'yes', 'on']
+				elif (k == 'compression'):
+					conf[k] = None if (v.lower() == 'none') else v
+				else:
+					print 'warning: unknown option %s in %s' % (k, fname)
+			except ValueError:
+				print 'warning: invalid value of %s in %s' % (k, fname)
+	return conf
+
+
+def crtoneh5(h5name, time, na, nch, ndata, **kwargs):
+	# create an All-in-One h5 file (layout version oneh5_version) with
+	# empty, chunked 'auto' and 'cross' datasets; the open file is returned
+	# the defaults of the options are those of h5config (see ldconfig)
+	#
+	# options:
+	#	tchunk		integrations per chunk (a chunk = 1 baseline)
+	#	chchunk		channels per chunk (default all)
+	#	compression	None, 'gzip' or 'lzf'
+	#	clevel		gzip level (0-9)
+	#	shuffle		shuffle filter, default on when compressed
+	#	scaleoffset	'auto' only: scale-offset filter keeping this
+	#			many decimal digits (lossy; None = off)
+	#	grow		resizable along time (for tloneh5)
+	#	precision	'double' (default) or 'single' (float32/complex64)
+	#	compact_ts	store regular timestamps as (t0, dt) + exceptions
+	#			(see TimeIndex; within tstol), default off;
+	#			not with grow
+	valid_op = ['tchunk', 'chchunk', 'compression', 'clevel', 'shuffle', 'scaleoffset', 'grow', 'precision', 'compact_ts']
+	kwargs = dict(ldconfig(), **kwargs)
+	for k in kwargs:
+		if (not(k in valid_op)):
+			print 'error: option %s is not defined.' % k
+			return None
+
+	grow	= kwargs.get('grow', False)
+	prec	= kwargs.get('precision', 'double')
+	compact	= kwargs.get('compact_ts', False)
+	(adtype, cdtype) = prectype[prec]
 
 	nb = na * (na-1) / 2
+	dopts = dsopts(nch, ndata, **kwargs)
+	aopts = dict(dopts)
+	if (kwargs.get('scaleoffset') is not None):
+		aopts['scaleoffset'] = kwargs['scaleoffset']
 
-	#with h5py.File(h5name, 'w') as f:
 	f = h5py.File(h5name, 'w')
 
 	f.attrs['na']	= na
@@ -104,22 +527,197 @@ def wtoneh5(h5name, time, auto, cross):
 	f.attrs['nsb']	= nsb
 	f.attrs['nch']	= nch
 	f.attrs['ndata']= ndata
+	f.attrs['version'] = oneh5_version
+	f.attrs['precision'] = prec
 
-	print '...  timestamp'
-	f.create_dataset('timestamp', data = time)
-	print '...  auto-corr (real)'
-	f.create_dataset('auto',      data = auto)
-	print '...  cross-corr (complex)'
-	f.create_dataset('cross',     data = cross)
+	_wttime(f, time, compact, grow)
+	if (grow):
+		f.create_dataset('auto',  (nsb, na, nch, ndata), dtype=adtype,
+			maxshape = (nsb, na, nch, None), **aopts)
+		f.create_dataset('cross', (nsb, nb, nch, ndata), dtype=cdtype,
+			maxshape = (nsb, nb, nch, None), **dopts)
+	else:
+		f.create_dataset('auto',  (nsb, na, nch, ndata), dtype=adtype, **aopts)
+		f.create_dataset('cross', (nsb, nb, nch, ndata), dtype=cdtype, **dopts)
 
-	f.close()
+	return f
 
-	print '... ', datetime.now().isoformat()
 
+def dsopts(nch, ndata, **kwargs):
+	# h5py create_dataset options of auto/cross, from the options tchunk,
+	# chchunk, compression, clevel, shuffle and grow of crtoneh5
+	tchunk	= kwargs.get('tchunk', 64)
+	chchunk	= kwargs.get('chchunk', nch)
+	comp	= kwargs.get('compression', None)
+	clevel	= kwargs.get('clevel', 4)
+	shuffle	= kwargs.get('shuffle', comp is not None)
+	if (kwargs.get('grow', False)):
+		tc = tchunk
+	else:
+		tc = max(1, min(tchunk, ndata))
+
+	dopts = {'chunks': (1, 1, max(1, min(chchunk, nch)), tc), 'shuffle': shuffle}
+	if (comp == 'gzip'):
+		dopts['compression'] = 'gzip'
+		dopts['compression_opts'] = clevel
+	elif (comp is not None):
+		dopts['compression'] = comp
+	return dopts
+
+
+def wtoneh5(h5name, time, auto, cross, **kwargs):
+	# write out the full dataset into an All-in-One h5 file
+	# (see crtoneh5 for the chunking/compression options; option summary
+	# is the channel range(s) of the summary products, None = no summary)
+	summary = kwargs.pop('summary', sumchs)
 
-def ldoneh5(h5name):
+	(nsb, na, nch, ndata) = auto.shape
+
+	f = crtoneh5(h5name, time, na, nch, ndata, **kwargs)
+	if (f is None):
+		return None
+
+	with span('write dataset', file=h5name) as sp:
+		print '...  auto-corr (real)'
+		f['auto'][...]  = auto
+		print '...  cross-corr (complex)'
+		f['cross'][...] = cross
+		f.close()
+		sp.add(auto.nbytes + cross.nbytes)
+
+	if (summary is not None):
+		smoneh5(h5name, summary)
+
+
+def vdsoneh5(fname, na, h5name):
+	# create an All-in-One h5 file made of HDF5 virtual datasets mapped
+	# onto the correlator files (no data is copied):
+	#	auto[s, i]	 --> <base>.<sb>.auto.h5:/autoII
+	#	cross_real[s, b] --> <base>.<sb>.cross.h5:/crossIJ/real
+	#	cross_imag[s, b] --> <base>.<sb>.cross.h5:/crossIJ/imag
+	# the complex 'cross' can not be mapped onto two float datasets, so it
+	# is assembled from cross_real/cross_imag by the readers (ldoneh5,
+	# OneH5Reader). the correlator files must stay next to the output.
+	nb = na * (na-1) / 2
+
+	(fbase, nch, ndata, time) = corrsrc(fname)
+	if (len(time) != ndata):
+		print 'warning: %d timestamps for %d integrations' % (len(time), ndata)
+		ndata = min(ndata, len(time))
+		time  = time[:ndata]
+
+	# source paths relative to the output file
+	odir = os.path.dirname(os.path.abspath(h5name))
+	with h5py.File(corrname(fbase, 0, 'auto'), 'r') as ha:
+		adtype = ha['auto00'].dtype
+	with h5py.File(corrname(fbase, 0, 'cross'), 'r') as hc:
+		cdtype = hc['cross01/real'].dtype
+
+	lauto = h5py.VirtualLayout(shape=(nsb, na, nch, ndata), dtype=adtype)
+	lre   = h5py.VirtualLayout(shape=(nsb, nb, nch, ndata), dtype=cdtype)
+	lim   = h5py.VirtualLayout(shape=(nsb, nb, nch, ndata), dtype=cdtype)
+	for s in range(nsb):
+		aname = os.path.relpath(os.path.abspath(corrname(fbase, s, 'auto')), odir)
+		cname = os.path.relpath(os.path.abspath(corrname(fbase, s, 'cross')), odir)
+		b = -1
+		for i in range(na):
+			lauto[s, i] = h5py.VirtualSource(aname, 'auto%d%d' % (i, i), shape=(nch, ndata))
+			for j in range(i+1, na):
+				b += 1
+				lre[s, b] = h5py.VirtualSource(cname, 'cross%d%d/real' % (i, j), shape=(nch, ndata))
+				lim[s, b] = h5py.VirtualSource(cname, 'cross%d%d/imag' % (i, j), shape=(nch, ndata))
+
+	with h5py.File(h5name, 'w') as f:
+		f.attrs['na']	= na
+		f.attrs['nb']	= nb
+		f.attrs['nsb']	= nsb
+		f.attrs['nch']	= nch
+		f.attrs['ndata']= ndata
+		f.attrs['version'] = oneh5_version
+		f.attrs['layout']  = 'vds'
+
+		_wttime(f, time)
+		f.create_virtual_dataset('auto', lauto)
+		f.create_virtual_dataset('cross_real', lre)
+		f.create_virtual_dataset('cross_imag', lim)
+
+
+def _selshape(shape, sel):
+	# shape of d[sel] for a tuple of integers and slices
+	out = []
+	for k in range(len(shape)):
+		if (k >= len(sel)):
+			out.append(shape[k])
+		elif (isinstance(sel[k], slice)):
+			out.append(len(range(*sel[k].indices(shape[k]))))
+	return tuple(out)
+
+
+def _ldsel(d, sel=(), dtype=None):
+	# read d[sel]; with dtype, HDF5 converts while reading (no extra copy)
+	if (dtype is None or d.dtype == dtype):
+		return d[sel]
+	out = np.empty(_selshape(d.shape, sel), dtype=dtype)
+	if (out.size > 0):
+		d.read_direct(out, sel if (sel) else None)
+	return out
+
+
+def _xdtype(f, xtype):
+	# the stored dtype of 'auto' or 'cross' of an open All-in-One h5 file
+	if (xtype == 'cross' and not 'cross' in f):
+		return np.result_type(f['cross_real'].dtype, np.complex64)
+	return f[xtype].dtype
+
+
+def _ldcross(f, sel=(), dtype=None):
+	# read cross[sel] of an open All-in-One h5 file, either stored as a
+	# complex dataset or (vds layout) as cross_real/cross_imag
+	# dtype = the complex dtype to return (None = as stored)
+	if ('cross' in f):
+		return _ldsel(f['cross'], sel, dtype)
+
+	if (dtype is None):
+		dtype = _xdtype(f, 'cross')
+	rdtype = np.zeros(1, dtype=dtype).real.dtype
+	re = _ldsel(f['cross_real'], sel, rdtype)
+	cross = np.empty(re.shape, dtype=dtype)
+	cross.real = re
+	del re
+	cross.imag = _ldsel(f['cross_imag'], sel, rdtype)
+	return cross
+
+
+def _mapdata(h5name):
+	# memory maps of the arrays of h5name: served from shared memory by
+	# the oneh5 server (see oneh5_server.py) when it is running and the
+	# file was loaded there (-load), or from an up-to-date raw cache
+	# <h5name>.mmap (see mmcache.py); else None. no data is copied here
+	import oneh5_server, mmcache
+	data = oneh5_server.fetch(h5name)
+	if (data is None):
+		data = mmcache.opencache(h5name)
+	return data
+
+
+def ldoneh5(h5name, precision=None):
 	# load the dataset from All-in-one h5 file
-	print '... ', datetime.now().isoformat()
+	# precision = None (as stored), 'double' or 'single'
+	# with the oneh5 server or a raw cache (see _mapdata), auto and cross
+	# are copy-on-write memory maps (no copy, no read at open time) unless
+	# converted by precision
+	sp = span('read oneh5', file=h5name)
+
+	(adtype, cdtype) = prectype[precision] if (precision) else (None, None)
+
+	data = _mapdata(h5name)
+	if (data is not None):
+		print '...  memory mapped'
+		time  = np.array(data['timestamp'])
+		auto  = data['auto'] if (adtype is None) else data['auto'].astype(adtype, copy=False)
+		cross = data['cross'] if (cdtype is None) else data['cross'].astype(cdtype, copy=False)
+		sp.close()
+		return time, auto, cross
 
 	with h5py.File(h5name, 'r') as f:
 		#na 	= f.attrs['na']
@@ -129,16 +727,594 @@ def ldoneh5(h5name):
 		#ndata	= f.attrs['ndata']
 
 		print '...  timestamp'
-		time = np.array(f.get('timestamp'))
+		time = _ldtime(f)
 		print '...  auto-corr (real)'
-		auto  = np.array(f.get('auto'))
+		auto  = _ldsel(f['auto'], (), adtype)
 		print '...  cross-corr (complex)'
-		cross = np.array(f.get('cross'))
+		cross = _ldcross(f, (), cdtype)
 
-	print '... ', datetime.now().isoformat()
+	sp.close(auto.nbytes + cross.nbytes)
 	return time, auto, cross
 
 
+class OneH5Reader(object):
+    # keep an All-in-One h5 file open and read only the requested slices
+    # chrange and trange are [start, stop) index ranges; None = full range
+    # precision = None (as stored), 'double' or 'single'
+    # server: read auto/cross from the oneh5 server (files loaded there)
+    # or the raw cache when available (see _mapdata); the other datasets
+    # are always read from the file
+    # cache: a SliceCache keeping the baselines read by vis/visbin (it may
+    # be shared by several readers)
+    # the reader is the visibility container of the tools: lazy handles
+    # of time/auto/cross with the baseline tables bi (see BaselineIndex);
+    # vis/visbin of a reversed pair (anti > antj) are conjugated
+
+    def __init__(self, h5name, precision=None, server=True, cache=None):
+	self.fname = h5name
+	self.precision = precision
+	self.server = server
+	self.cache = cache
+	self.reopen = (h5name, precision, server)	# arguments of a copy
+							# (e.g. in a worker)
+	self.f = h5py.File(h5name, 'r')
+	self.maps = _mapdata(h5name) if (server) else None
+	if (precision):
+	    (self.adtype, self.cdtype) = prectype[precision]
+	else:
+	    self.adtype = _xdtype(self.f, 'auto')
+	    self.cdtype = _xdtype(self.f, 'cross')
+
+	(self.nsb, self.na, self.nch, self.ndata) = self.f['auto'].shape
+	self.tindex = ldtindex(self.f)
+	self.version = self.f.attrs.get('version', 1)
+	self.bi = BaselineIndex(self.na)
+	self.nb = self.bi.nb
+	self.shape = (self.nsb, self.na, self.nch, self.ndata)
+	# the content of the file in the keys of self.cache, so that a file
+	# that changed (grown, converted again) is not served from it
+	from mmcache import cachekey
+	self.ckey = (h5name, cachekey(h5name), precision, self.ndata)
+
+
+    def close(self):
+	self.maps = None
+	if (self.f is not None):
+	    self.f.close()
+	    self.f = None
+
+
+    def __enter__(self):
+	return self
+
+
+    def __exit__(self, *args):
+	self.close()
+
+
+    def baseline(self, anti, antj):
+	# baseline index b of the pair (anti, antj), same order as in ldcorr
+	return self.bi.bl[anti, antj]
+
+
+    def _sel(self, rng, n):
+	if (rng is None):
+	    return slice(0, n)
+	return slice(int(rng[0]), int(rng[1]))
+
+
+    def timestamp(self, trange=None):
+	ts = self._sel(trange, self.ndata)
+	return self.tindex.times([ts.start, ts.stop])
+
+
+    def trange(self, tlim=None):
+	# [start, stop) integration range of the time range tlim (absolute)
+	return self.tindex.range(tlim)
+
+
+    def auto(self, sb, ant, chrange=None, trange=None):
+	# returns auto[sb, ant, chrange, trange] --> (nch, npt)
+	cs = self._sel(chrange, self.nch)
+	ts = self._sel(trange, self.ndata)
+	if (self.maps is not None):
+	    return np.array(self.maps['auto'][sb, ant, cs, ts], dtype=self.adtype)
+	return _ldsel(self.f['auto'], (sb, ant, cs, ts), self.adtype)
+
+
+    def cross(self, sb, b, chrange=None, trange=None):
+	# returns cross[sb, b, chrange, trange] --> (nch, npt)
+	cs = self._sel(chrange, self.nch)
+	ts = self._sel(trange, self.ndata)
+	if (self.maps is not None):
+	    return np.array(self.maps['cross'][sb, b, cs, ts], dtype=self.cdtype)
+	return _ldcross(self.f, (sb, b, cs, ts), self.cdtype)
+
+
+    def _summary(self, dname, **attrs):
+	# the stored summary dataset dname if it was made for this ndata
+	# and with the given attrs, otherwise None
+	if (not dname in self.f):
+	    return None
+	d = self.f[dname]
+	if (d.attrs.get('ndata', -1) != self.ndata):
+	    return None
+	for k in attrs:
+	    if (d.attrs.get(k, None) != attrs[k]):
+		return None
+	return d
+
+
+    def block(self, xtype, chrange=None, trange=None):
+	# xtype[:, :, chrange, trange] for all sidebands and baselines
+	sel = (slice(None), slice(None), self._sel(chrange, self.nch), self._sel(trange, self.ndata))
+	if (self.maps is not None):
+	    return np.array(self.maps[xtype][sel], dtype=(self.adtype if (xtype == 'auto') else self.cdtype))
+	if (xtype == 'auto'):
+	    return _ldsel(self.f['auto'], sel, self.adtype)
+	else:
+	    return _ldcross(self.f, sel, self.cdtype)
+
+
+    def chavg(self, xtype, chlim, trange=None, tblock=None, stored=True):
+	# xtype[:, :, chlim[0]:chlim[1], trange].mean(axis=2) --> (nsb, nb|na, npt)
+	# uses the stored channel average of the same chlim (see smoneh5),
+	# otherwise reads blocks of tblock integrations (None: see blockreduce)
+	# no integration in trange: an empty average (npt = 0)
+	ts = self._sel(trange, self.ndata)
+	dtype = self.adtype if (xtype == 'auto') else self.cdtype
+	if (min(ts.stop, self.ndata) <= ts.start):
+	    return np.zeros((self.nsb, self.na if (xtype == 'auto') else self.nb, 0), dtype=dtype)
+	if (stored):
+	    chlim = [min(c, self.nch) for c in chlim]
+	    for dname in _caname(xtype, chlim):
+		d = self._summary(dname, chmin=chlim[0], chmax=chlim[1])
+		if (d is not None):
+		    return d[:, :, ts]
+
+	sp = span('chavg', xtype=xtype)
+	res = blkreduce(self, xtype, (2,), ['mean'], chlim, trange=[ts.start, ts.stop], tblock=tblock)
+	sp.close()
+	return res['mean'].astype(dtype)
+
+
+    def tavg(self, xtype, trange=None, tblock=None, stored=True):
+	# xtype[:, :, :, trange].mean(axis=3) --> (nsb, nb|na, nch)
+	# uses the stored '<xtype>_ta' when it was made for the same trange,
+	# otherwise accumulates blocks in double precision (see chavg)
+	# no integration in trange: NaN, as the mean of nothing
+	ts = self._sel(trange, self.ndata)
+	dtype = self.adtype if (xtype == 'auto') else self.cdtype
+	if (min(ts.stop, self.ndata) <= ts.start):
+	    return np.full((self.nsb, self.na if (xtype == 'auto') else self.nb, self.nch), np.nan, dtype=dtype)
+	if (stored):
+	    d = self._summary(xtype + '_ta', tmin=ts.start, tmax=ts.stop)
+	    if (d is not None):
+		return d[...]
+
+	sp = span('tavg', xtype=xtype)
+	res = blkreduce(self, xtype, (3,), ['mean'], trange=[ts.start, ts.stop], tblock=tblock)
+	sp.close()
+	return res['mean'].astype(dtype)
+
+
+    def level(self, chbin, tbin):
+	# the coarsest pyramid level (see pyroneh5) from which the
+	# (chbin, tbin) binning can be made exactly; 1 = full resolution
+	g = self._summary('pyramid')
+	if (g is None):
+	    return 1
+	best = 1
+	for fac in g.attrs['levels']:
+	    if (chbin % fac == 0 and tbin % fac == 0):
+		best = max(best, fac)
+	return best
+
+
+    def visbin(self, sb, anti, antj, chbin, tbin, chrange=None, trange=None):
+	# vis(sb, anti, antj) averaged over chbin x tbin bins, trailing
+	# incomplete bins dropped; read from the coarsest usable pyramid level
+	# chrange/trange: [start, stop) at full resolution, moved down to bin
+	# boundaries; only the bins in these ranges are read and averaged
+	# (the same bins as those of the full range)
+	if (self.bi.conj[anti, antj]):
+	    return self.visbin(sb, antj, anti, chbin, tbin, chrange, trange).conjugate()
+	cr = _binrange(chrange, self.nch, chbin)
+	tr = _binrange(trange, self.ndata, tbin)
+	if (chbin == 1 and tbin == 1):
+	    return self.vis(sb, anti, antj, cr, tr)
+
+	fac = self.level(chbin, tbin)
+	sp = span('rebin', chbin=chbin, tbin=tbin, level=fac)
+	if (fac == 1):
+	    raw = self.vis(sb, anti, antj, cr, tr)
+	else:
+	    # the ranges are multiples of fac, so they are exact on the level
+	    g = self.f['pyramid/%d' % fac]
+	    raw = self._cached(('pyramid', fac, sb, anti, antj), g['auto'].shape[2:],
+		lambda c, t: self._pyrvis(fac, sb, anti, antj, c, t),
+		[cr[0] // fac, cr[1] // fac], [tr[0] // fac, tr[1] // fac])
+	out = _rebin(raw, chbin // fac, tbin // fac)
+	sp.close(raw.nbytes)
+	return out
+
+
+    def _pyrvis(self, fac, sb, anti, antj, chrange=None, trange=None):
+	# vis(sb, anti, antj, chrange, trange) of pyramid level fac
+	g = self.f['pyramid/%d' % fac]
+	(nc, nt) = g['auto'].shape[2:]
+	(cs, ts) = (self._sel(chrange, nc), self._sel(trange, nt))
+	if (anti == antj):
+	    return _ldsel(g['auto'], (sb, anti, cs, ts), self.adtype)
+	else:
+	    return _ldsel(g['cross'], (sb, self.baseline(anti, antj), cs, ts), self.cdtype)
+
+
+    def vis(self, sb, anti, antj, chrange=None, trange=None):
+	# auto if anti == antj, otherwise cross of baseline anti-antj,
+	# conjugated if anti > antj (only the stored order is cached)
+	if (self.bi.conj[anti, antj]):
+	    return self.vis(sb, antj, anti, chrange, trange).conjugate()
+	return self._cached(('vis', sb, anti, antj), (self.nch, self.ndata),
+		lambda c, t: self._vis(sb, anti, antj, c, t), chrange, trange)
+
+
+    def _vis(self, sb, anti, antj, chrange=None, trange=None):
+	if (anti == antj):
+	    return self.auto(sb, anti, chrange, trange)
+	else:
+	    return self.cross(sb, self.baseline(anti, antj), chrange, trange)
+
+
+    def _cached(self, key, shape, get, chrange, trange):
+	# get(chrange, trange) of an (nch, ndata) = shape array, through
+	# self.cache: a slice of the full range if that is kept, otherwise
+	# only the ranges are read and kept, under
+	# self.ckey + key + (chrange, trange)
+	if (self.cache is None):
+	    return get(chrange, trange)
+	key = self.ckey + key
+	(ck, tk) = (_rngkey(chrange, shape[0]), _rngkey(trange, shape[1]))
+	full = key + (None, None)
+	if ((ck, tk) != (None, None) and full in self.cache):
+	    return self.cache.get(full)[self._sel(ck, shape[0]), self._sel(tk, shape[1])]
+	return self.cache.get(key + (ck, tk), lambda: get(chrange, trange))
+
+
+
+def _rngkey(rng, n):
+	# hashable form of the index range rng of n (None = the full range)
+	if (rng is None or (int(rng[0]) <= 0 and int(rng[1]) >= n)):
+		return None
+	return (int(rng[0]), int(rng[1]))
+
+
+def _binrange(rng, n, nbin):
+	# [start, stop) of rng (None: all of n) moved down to multiples of
+	# nbin, within the complete bins of n
+	(i0, i1) = (0, n) if (rng is None) else (int(rng[0]), min(int(rng[1]), n))
+	return [i0 // nbin * nbin, i1 // nbin * nbin]
+
+
+
+class CorrReader(OneH5Reader):
+    # the correlator files of an observation (see corrsrc) read like a
+    # oneh5 file, with the OneH5Reader methods: the files stay open and
+    # only the requested slices are read. there are no summaries or
+    # pyramid, so chavg/tavg/visbin are computed from the data.
+    # na is needed, as for ldcorr; precision = None (as stored), 'double'
+    # (the default, as ldcorr) or 'single'
+
+    def __init__(self, fname, na, precision='double', cache=None):
+	(fbase, nch, ndata, time) = corrsrc(fname)
+	self.fname = fname
+	self.precision = precision
+	self.server = False
+	self.cache = cache
+	self.reopen = (fname, na, precision)
+	self.maps = None
+	self.f = None
+	self.files = []
+	for s in range(nsb):
+	    self.files.append((h5py.File(corrname(fbase, s, 'auto'), 'r'), h5py.File(corrname(fbase, s, 'cross'), 'r')))
+	if (precision):
+	    (self.adtype, self.cdtype) = prectype[precision]
+	else:
+	    self.adtype = self.files[0][0]['auto00'].dtype
+	    self.cdtype = np.result_type(self.files[0][1]['cross01/real'].dtype, np.complex64)
+
+	(self.nsb, self.na, self.nch, self.ndata) = (nsb, na, nch, ndata)
+	self.tindex = TimeIndex(ndata, time=time)
+	self.version = 0
+	self.bi = BaselineIndex(na)
+	self.nb = self.bi.nb
+	self.shape = (self.nsb, self.na, self.nch, self.ndata)
+	from mmcache import cachekey
+	self.ckey = (fname, tuple([cachekey(h.filename) for hs in self.files for h in hs]), precision, ndata)
+
+
+    def close(self):
+	for (ha, hc) in self.files:
+	    ha.close()
+	    hc.close()
+	self.files = []
+
+
+    def auto(self, sb, ant, chrange=None, trange=None):
+	cs = self._sel(chrange, self.nch)
+	ts = self._sel(trange, self.ndata)
+	d = self.files[sb][0]['auto%d%d' % (ant, ant)]
+	return np.asarray(d[cs, ts], dtype=self.adtype)
+
+
+    def cross(self, sb, b, chrange=None, trange=None):
+	cs = self._sel(chrange, self.nch)
+	ts = self._sel(trange, self.ndata)
+	g = self.files[sb][1]['cross%s' % self.bi.name(b)]
+	out = np.empty((cs.stop - cs.start, ts.stop - ts.start), dtype=self.cdtype)
+	out.real = g['real'][cs, ts]
+	out.imag = g['imag'][cs, ts]
+	return out
+
+
+    def _summary(self, dname, **attrs):
+	return None
+
+
+    def block(self, xtype, chrange=None, trange=None):
+	cs = self._sel(chrange, self.nch)
+	ts = self._sel(trange, self.ndata)
+	if (xtype == 'auto'):
+	    (n, get, dtype) = (self.na, self.auto, self.adtype)
+	else:
+	    (n, get, dtype) = (self.nb, self.cross, self.cdtype)
+	out = np.empty((self.nsb, n, cs.stop - cs.start, ts.stop - ts.start), dtype=dtype)
+	for sb in range(self.nsb):
+	    for k in range(n):
+		out[sb, k] = get(sb, k, chrange, trange)
+	return out
+
+
+
+class SliceCache(object):
+    # least-recently-used cache of arrays (e.g. the baselines read by the
+    # GUI) within maxbytes (default cachemem) in total; the oldest entries
+    # are dropped to make room, an entry larger than maxbytes is not kept.
+    # an entry is an array or a tuple of arrays; they are made read-only,
+    # as every get of the key returns the same arrays
+
+    def __init__(self, maxbytes=None):
+	self.maxbytes = cachemem if (maxbytes is None) else maxbytes
+	self.entries = OrderedDict()
+	self.nbytes = 0
+	self.hits = 0
+	self.misses = 0
+
+
+    def __len__(self):
+	return len(self.entries)
+
+
+    def __contains__(self, key):
+	return key in self.entries
+
+
+    def get(self, key, load=None):
+	# the entry of key, now the most recent; if there is none, that of
+	# load() (kept for the next time), or None without load
+	if (key in self.entries):
+	    self.hits += 1
+	    val = self.entries.pop(key)
+	    self.entries[key] = val
+	    return val
+	self.misses += 1
+	if (load is None):
+	    return None
+	val = load()
+	self.put(key, val)
+	return val
+
+
+    def put(self, key, val):
+	if (key in self.entries):
+	    self.nbytes -= _nbytes(self.entries.pop(key))
+	n = _nbytes(val)
+	if (n > self.maxbytes):
+	    return
+	for a in (val if (isinstance(val, tuple)) else (val,)):
+	    if (isinstance(a, np.ndarray)):
+		a.flags.writeable = False
+	self.entries[key] = val
+	self.nbytes += n
+	self.trim()
+
+
+    def trim(self, maxbytes=None):
+	# drop the oldest entries until the total is within maxbytes
+	# (default self.maxbytes)
+	if (maxbytes is None):
+	    maxbytes = self.maxbytes
+	while (self.entries and self.nbytes > maxbytes):
+	    (key, val) = self.entries.popitem(last=False)
+	    self.nbytes -= _nbytes(val)
+
+
+    def clear(self):
+	self.trim(0)
+
+
+    def drop(self, fname):
+	# drop the entries of the file fname (the keys that start with it,
+	# as those of the readers, see OneH5Reader.ckey)
+	for key in [k for k in self.entries if (k[0] == fname)]:
+	    self.nbytes -= _nbytes(self.entries.pop(key))
+
+
+    def stats(self):
+	return '%d entries, %.1f of %.1f MB, %d hits, %d misses' % (len(self.entries),
+		self.nbytes / 1048576., self.maxbytes / 1048576., self.hits, self.misses)
+
+
+def _nbytes(val):
+	# bytes of the arrays of a SliceCache entry
+	if (isinstance(val, tuple)):
+		return sum([_nbytes(a) for a in val])
+	return getattr(val, 'nbytes', 0)
+
+
+def _caname(xtype, chlim):
+	# the dataset names of the stored channel average of xtype over chlim:
+	# '<xtype>_ca' for the first range of smoneh5, '<xtype>_ca_<c0>_<c1>'
+	# for the others
+	return [xtype + '_ca', '%s_ca_%d_%d' % (xtype, chlim[0], chlim[1])]
+
+
+def smoneh5(h5name, chlim=sumchs, tblock=None):
+	# store the summary products next to the cube:
+	#	auto_ca, cross_ca	channel average over [chlim[0], chlim[1])
+	#				(attrs chmin, chmax); chlim may also be a
+	#				list of ranges (default sumchs, those of
+	#				the tools), one average each (see _caname)
+	#	auto_ta, cross_ta	time average over all integrations
+	#				(attrs tmin, tmax)
+	# all are tagged with ndata, so they are ignored once the file grows.
+	# the ranges are clipped to the channels of the file; a range with no
+	# channel left is skipped
+	if (np.ndim(chlim) == 1):
+		chlim = [chlim]
+	print '...  summary, chlim =', chlim
+	sp = span('summary', file=h5name)
+	## a file that is just written is read directly, not through the server
+	with OneH5Reader(h5name, server=False) as r:
+		prod = {}
+		for xtype in ['auto', 'cross']:
+			done = []
+			for ch in chlim:
+				cr = [min(c, r.nch) for c in ch]
+				if (cr[0] >= cr[1]):
+					if (xtype == 'auto'):
+						print 'warning: %s has no channel in chlim %s (nch %d), not stored' % (h5name, list(ch), r.nch)
+					continue
+				if (cr in done):
+					continue
+				dname = _caname(xtype, cr)[1 if (done) else 0]
+				prod[dname] = (r.chavg(xtype, cr, tblock=tblock, stored=False), cr)
+				done.append(cr)
+			prod[xtype + '_ta'] = (r.tavg(xtype, tblock=tblock, stored=False), None)
+		ndata = r.ndata
+
+	with h5py.File(h5name, 'a') as f:
+		for dname in [k for k in f if (k.startswith('auto_ca') or k.startswith('cross_ca'))]:
+			del f[dname]
+		for dname in sorted(prod.keys()):
+			if (dname in f):
+				del f[dname]
+			(arr, cr) = prod[dname]
+			d = f.create_dataset(dname, data = arr)
+			d.attrs['ndata'] = ndata
+			if (cr is not None):
+				d.attrs['chmin'] = cr[0]
+				d.attrs['chmax'] = cr[1]
+			else:
+				d.attrs['tmin'] = 0
+				d.attrs['tmax'] = ndata
+	sp.close()
+
+
+def _rebin(x, N0, N1):
+	# mean over N0 x N1 bins of the last two axes, trailing incomplete
+	# bins are dropped (as in gui_viewer.dataRebin)
+	(M0, M1) = x.shape[-2:]
+	nbin0 = M0 // N0
+	nbin1 = M1 // N1
+	x = x[..., :(nbin0 * N0), :(nbin1 * N1)]
+	return x.reshape(x.shape[:-2] + (nbin0, N0, nbin1, N1)).mean(axis=(-3,-1))
+
+
+def pyroneh5(h5name, nlev=6, tblock=1024):
+	# build a multi-resolution pyramid of the cube in group 'pyramid':
+	#	pyramid/<f>/{timestamp,auto,cross}, f = 2, 4, ... 2**nlev
+	# level f is the mean over f channels x f integrations (trailing
+	# incomplete bins dropped), made from level f/2 block by block
+	print '...  pyramid, nlev =', nlev
+	sp = span('pyramid', file=h5name)
+	tblock += tblock % 2
+
+	f = h5py.File(h5name, 'a')
+	if ('pyramid' in f):
+		del f['pyramid']
+	gp = f.create_group('pyramid')
+	gp.attrs['ndata'] = f['auto'].shape[-1]
+
+	prev = f
+	for lev in range(1, nlev+1):
+		fac = 2**lev
+		(nsb, na, nch, ndata) = prev['auto'].shape
+		if (nch < 2 or ndata < 2):
+			break
+		nb = f.attrs.get('nb', na * (na-1) / 2)
+
+		g = gp.create_group('%d' % fac)
+		g.create_dataset('timestamp', data = _rebin(_ldtime(prev)[:ndata//2*2].reshape(1, -1), 1, 2)[0])
+		for (xtype, n) in [('auto', na), ('cross', nb)]:
+			d = g.create_dataset(xtype, (nsb, n, nch//2, ndata//2), dtype=_xdtype(prev, xtype),
+				chunks = (1, 1, nch//2, max(1, min(64, ndata//2))))
+			for sb in range(nsb):
+				for b in range(n):
+					for t0 in range(0, ndata//2*2, tblock):
+						t1 = min(t0 + tblock, ndata//2*2)
+						if (xtype == 'cross' and prev is f):
+							blk = _ldcross(f, (sb, b, slice(None), slice(t0, t1)))
+						else:
+							blk = prev[xtype][sb, b, :, t0:t1]
+						d[sb, b, :, t0//2:t1//2] = _rebin(blk, 2, 2)
+						sp.add(blk.nbytes)
+		prev = g
+
+	gp.attrs['levels'] = sorted([int(k) for k in gp.keys()])
+	f.close()
+	sp.close()
+
+
+def chkprec(h5ref, h5test=None, tblock=1024):
+	# report the maximum relative error of auto/cross in h5test against
+	# the reference h5ref, read in double precision; without h5test, the
+	# error of storing h5ref in single precision is reported
+	# returns {'auto': err, 'cross': err}
+	err = {}
+	rr = OneH5Reader(h5ref, 'double')
+	if (h5test is None):
+		rt = None
+	else:
+		rt = OneH5Reader(h5test, 'double')
+		if (rt.shape != rr.shape):
+			print 'error: shapes differ', rr.shape, rt.shape
+			return None
+
+	for xtype in ['auto', 'cross']:
+		emax = 0.
+		for t0 in range(0, rr.ndata, tblock):
+			t1 = min(t0 + tblock, rr.ndata)
+			ref = rr.block(xtype, None, [t0, t1])
+			if (rt is None):
+				dtype = prectype['single'][0 if (xtype == 'auto') else 1]
+				tst = ref.astype(dtype)
+			else:
+				tst = rt.block(xtype, None, [t0, t1])
+			w = (ref != 0.)
+			if (w.any()):
+				emax = max(emax, (np.abs(tst[w] - ref[w]) / np.abs(ref[w])).max())
+			if (not np.array_equal(tst[~w], ref[~w])):
+				emax = np.inf
+		err[xtype] = emax
+		print '...  %s: max relative error = %.3e' % (xtype, emax)
+
+	rr.close()
+	if (rt is not None):
+		rt.close()
+	return err
+
+
 def adoneh5(h5name, darray, dname):
 	#print datetime.now().isoformat()
 
@@ -154,15 +1330,13 @@ def newraw(rawh5, na):
 	# update: can create a new one from basename (without .timestamp)
 
 	if (rawh5.endswith('.raw.oneh5')):
-		base = rawh5.rstrip('.raw.oneh5')
+		base = rawh5[:-len('.raw.oneh5')]
 	else:
 		print 'expecting rawh5 file ends with ".raw.oneh5"'
 		return None
 
-	(time, auto, cross) = ldcorr(base, na)
-
 	print 'output to %s' % rawh5
-	wtoneh5(rawh5, time, auto, cross)
+	cvcorr(base, na, rawh5)
 
 
 ## self-test
@@ -178,30 +1352,116 @@ if (False):
 if (__name__ == '__main__'):
 
 
-    inp = sys.argv[0:]
+    inp = ytlatrace.argv(sys.argv[0:])
     pg  = inp.pop(0)
     usage = '''
     program needs two arguments.
 
-    %s <file_base> <na>
+    %s <file_base> <na> [options]
+    %s -chkprec <ref_oneh5> [test_oneh5]
 
 	<file_base> = something like './data/2017_Oct_26_03_35_27.ytla'
 	if the .h5 files are in the current directory, the path can be omitted
 
-    ''' % pg
+	options are:
+	-gzip level	# gzip-compress auto/cross (level 0-9)
+	-lzf		# lzf-compress auto/cross (fast, lower ratio)
+	-noshuffle	# do not apply the shuffle filter before compression
+	-tchunk N	# integrations per chunk (default 64)
+	-tblock N	# integrations copied per block (default 1024)
+	-single		# store auto/cross as float32/complex64 (half the size)
+	-trace [f.json]	# time the phases (summary table, JSON trace to f.json)
+	-compactts	# store regular timestamps as t0, dt + exceptions,
+			# within %.1f ms (default: every timestamp)
+	-sumcr c1 c2	# channel range of the stored channel averages, may be
+			# repeated (default %s)
+	-nosum		# do not store the channel/time-averaged summaries
+	-pyr nlev	# also build a pyramid of 2x, 4x, .. 2**nlev binned
+			# copies for interactive browsing
+	-j N		# read the correlator files with N processes
+	-vds		# no copy: map the oneh5 onto the correlator files
+			# (HDF5 virtual datasets)
+	-tail		# incremental: append only the new integrations to an
+			# existing (resizable) oneh5 while the correlator is running
+	-watch sec	# like -tail, repeated every <sec> seconds (Ctrl-C to stop)
+
+	-chkprec reports the max. relative error of test_oneh5 against
+	ref_oneh5 (or of storing ref_oneh5 in single precision)
+
+    ''' % (pg, pg, tstol * 1e3, ', '.join(['%d:%d' % tuple(c) for c in sumchs]))
+
+    if (len(inp) >= 2 and inp[0] == '-chkprec'):
+	chkprec(*inp[1:3])
 
-    if (len(inp) >= 2):
+    elif (len(inp) >= 2):
 	fname = inp.pop(0)
 	na = int(inp.pop(0))
 
+	opts = {}
+	while (inp):
+	    arg = inp.pop(0)
+	    try:
+		if (arg == '-gzip'):
+		    opts['compression'] = 'gzip'
+		    opts['clevel'] = int(inp.pop(0))
+		elif (arg == '-lzf'):
+		    opts['compression'] = 'lzf'
+		elif (arg == '-noshuffle'):
+		    opts['shuffle'] = False
+		elif (arg == '-tchunk'):
+		    opts['tchunk'] = int(inp.pop(0))
+		elif (arg == '-tblock'):
+		    opts['tblock'] = int(inp.pop(0))
+		elif (arg == '-single'):
+		    opts['precision'] = 'single'
+		elif (arg == '-compactts'):
+		    opts['compact_ts'] = True
+		elif (arg == '-sumcr'):
+		    c1 = int(inp.pop(0))
+		    c2 = int(inp.pop(0))
+		    opts['summary'] = (opts.get('summary') or []) + [[c1, c2]]
+		elif (arg == '-nosum'):
+		    opts['summary'] = None
+		elif (arg == '-pyr'):
+		    opts['pyramid'] = int(inp.pop(0))
+		elif (arg == '-j'):
+		    opts['nproc'] = int(inp.pop(0))
+		elif (arg == '-vds'):
+		    opts['vds'] = True
+		elif (arg == '-tail'):
+		    opts['tail'] = 0.
+		elif (arg == '-watch'):
+		    opts['tail'] = float(inp.pop(0))
+		else:
+		    print 'unknown option:', arg
+	    except (ValueError, IndexError):
+		print 'error reading option:', arg
+
 	if (fname.endswith('.timestamp')):
-	    fname.rstrip('.timestamp')
+	    fname = fname[:-len('.timestamp')]
 
 	fout = fname + '.raw.oneh5'
-	print 'reading data ...'
-	time, auto, cross = ldcorr(fname, na)
-	print 'writing data ...'
-	wtoneh5(fout, time, auto, cross)
+	nlev = opts.pop('pyramid', 0)
+	if (opts.pop('vds', False)):
+	    print 'mapping data ...'
+	    vdsoneh5(fname, na, fout)
+	elif ('tail' in opts):
+	    import time as systime
+	    wait = opts.pop('tail')
+	    print 'appending data ...'
+	    tloneh5(fname, na, fout, **opts)
+	    try:
+		while (wait > 0.):
+		    systime.sleep(wait)
+		    tloneh5(fname, na, fout, **opts)
+	    except KeyboardInterrupt:
+		print 'stopped.'
+	else:
+	    print 'converting data ...'
+	    cvcorr(fname, na, fout, **opts)
+
+	if (nlev > 0):
+	    pyroneh5(fout, nlev)
 
     else:
 	print usage	
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+import numpy as np
+import h5py
+import sys, os.path
+from loadh5 import *
+from visdata import *
+
+
+#-- defaults --
+tint	= 0.678		# integration time (sec)
+t0	= 1.5e9		# linux time of the 1st integration
+
+
+def synth(fbase, na=7, nch=1024, ndata=2000, **kwargs):
+	# write a synthetic observation in the format of the correlator:
+	#	<fbase>.<lsb|usb>.auto.h5	autoII			(nch, ndata)
+	#	<fbase>.<lsb|usb>.cross.h5	crossIJ/{real,imag}	(nch, ndata)
+	#	<fbase>.timestamp		one '%.3f' line per integration
+	#	<fbase>_timing.txt		patch timing for track2sefd:
+	#					off, on, on, ... on, off
+	# the model is a point source tracked in the 'on' patches:
+	#	auto_i	= |g_i|^2 (Tsys + S) (1 + radiometer noise)
+	#	cross_ij= g_i g_j* S exp(i fringe) + noise
+	# with smooth bandpasses g_i(ch) and an antenna-based delay.
+	#
+	# options:
+	#	npatch	number of timing patches (default 7)
+	#	snr	source/Tsys ratio (default 0.05)
+	#	noise	radiometer noise per integration and channel (0.01)
+	#	dtype	correlator precision (default float32)
+	#	tblock	integrations generated at a time (default 1024)
+	#	seed	random seed (default 0)
+	npatch	= kwargs.get('npatch', 7)
+	snr	= kwargs.get('snr', 0.05)
+	noise	= kwargs.get('noise', 0.01)
+	dtype	= kwargs.get('dtype', np.float32)
+	tblock	= kwargs.get('tblock', 1024)
+	rs	= np.random.RandomState(kwargs.get('seed', 0))
+
+	bi = BaselineIndex(na)
+	ch = np.arange(nch, dtype=float)
+	time = t0 + tint * np.arange(ndata)
+
+	#-- patches: equal length, 10% gap after each --
+	plen = ndata / float(npatch)
+	ton  = np.arange(npatch) * plen
+	toff = ton + 0.9 * plen - 1
+	src = np.zeros(ndata)
+	for p in range(1, npatch-1):
+		src[int(np.ceil(ton[p])):int(toff[p])+1] = 1.
+	with open(fbase + '_timing.txt', 'w') as f:
+		for p in range(npatch):
+			state = 'off' if (p == 0 or p == npatch-1) else 'on'
+			print >> f, '%5.0f   %5.0f   %s   %s' % (ton[p]*tint, toff[p]*tint, 'patch%02d' % p, state)
+
+	np.savetxt(fbase + '.timestamp', time, fmt='%.3f')
+
+	for s in range(nsb):
+		#-- antenna gains: bandpass ripple, edge roll-off, delay --
+		edge = np.exp(-((ch - nch/2.) / (0.47 * nch))**8)
+		amp  = (1. + 0.2 * rs.rand(na, 1)) * edge * (1. + 0.1 * np.sin(2.*np.pi * ch / (nch/3.) + 6. * rs.rand(na, 1)))
+		pha  = 2.*np.pi * rs.randn(na, 1) * ch / nch + 6. * rs.rand(na, 1)
+		g    = amp * np.exp(1j * pha)		# (na, nch)
+		gx   = g[bi.ant1] * g[bi.ant2].conjugate()	# (nb, nch)
+		fringe = 2.*np.pi * rs.rand(bi.nb, 1) * np.arange(ndata) / 500.
+
+		ha = h5py.File(corrname(fbase, s, 'auto'), 'w')
+		hc = h5py.File(corrname(fbase, s, 'cross'), 'w')
+		for i in range(na):
+			ha.create_dataset('auto%d%d' % (i, i), (nch, ndata), dtype=dtype)
+		for b in range(bi.nb):
+			g1 = hc.create_group('cross%d%d' % (bi.ant1[b], bi.ant2[b]))
+			g1.create_dataset('real', (nch, ndata), dtype=dtype)
+			g1.create_dataset('imag', (nch, ndata), dtype=dtype)
+
+		for i0 in range(0, ndata, tblock):
+			i1 = min(i0 + tblock, ndata)
+			S = snr * src[i0:i1]
+			for i in range(na):
+				pw = np.abs(g[i])[:, None]**2 * (1. + S)
+				ha['auto%d%d' % (i, i)][:, i0:i1] = pw * (1. + noise * rs.randn(nch, i1-i0))
+			for b in range(bi.nb):
+				v = gx[b][:, None] * S * np.exp(1j * fringe[b, i0:i1])
+				n = noise * np.abs(gx[b])[:, None] / np.sqrt(2.)
+				d = hc['cross%d%d' % (bi.ant1[b], bi.ant2[b])]
+				d['real'][:, i0:i1] = v.real + n * rs.randn(nch, i1-i0)
+				d['imag'][:, i0:i1] = v.imag + n * rs.randn(nch, i1-i0)
+		ha.close()
+		hc.close()
+
+
+if (__name__ == '__main__'):
+
+    inp = sys.argv[0:]
+    pg  = inp.pop(0)
+    usage = '''
+    write a synthetic YTLA observation (correlator .h5 files, .timestamp
+    and _timing.txt), optionally converted to <file_base>.raw.oneh5
+
+    %s <file_base> [options]
+
+	options are:
+	-na N		# number of antennas (default 7)
+	-nch N		# number of channels (default %d)
+	-ndata N	# number of integrations (default 2000)
+	-npatch N	# number of timing patches (default 7)
+	-seed N		# random seed (default 0)
+	-f64		# write float64 correlator files (default float32)
+	-oneh5		# also convert to <file_base>.raw.oneh5 (loadh5.cvcorr)
+
+    ''' % (pg, nch)
+
+    if (len(inp) < 1):
+	print usage
+	sys.exit()
+
+    fbase = inp.pop(0)
+    (na, nc, ndata) = (7, nch, 2000)
+    opts = {}
+    oneh5 = False
+    while (inp):
+	arg = inp.pop(0)
+	try:
+	    if (arg == '-na'):
+		na = int(inp.pop(0))
+	    elif (arg == '-nch'):
+		nc = int(inp.pop(0))
+	    elif (arg == '-ndata'):
+		ndata = int(inp.pop(0))
+	    elif (arg == '-npatch'):
+		opts['npatch'] = int(inp.pop(0))
+	    elif (arg == '-seed'):
+		opts['seed'] = int(inp.pop(0))
+	    elif (arg == '-f64'):
+		opts['dtype'] = np.float64
+	    elif (arg == '-oneh5'):
+		oneh5 = True
+	    else:
+		print 'unknown option:', arg
+	except (ValueError, IndexError):
+	    print 'error reading option:', arg
+
+    print 'synthetic data: na=%d, nch=%d, ndata=%d --> %s' % (na, nc, ndata, fbase)
+    synth(fbase, na, nc, ndata, **opts)
+    if (oneh5):
+	cvcorr(fbase, na, fbase + '.raw.oneh5')
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+import numpy as np
+import sys, os, os.path
+import json, hashlib
+
+# raw cache of a oneh5 file for memory mapping: timestamp, auto and cross
+# stored uncompressed in one file, each array aligned to a page:
+#
+#	0		magic 'YTLAMMAP', header length (uint64, little endian)
+#	16		JSON header:
+#			{"version": 1, "source": <oneh5>, "key": <cachekey>,
+#			 "arrays": {name: {"dtype", "shape", "offset"}, ...}}
+#	offset		array data (C order), offsets are multiples of align
+#
+# ldcache() maps the arrays with no copy and no read at open time; the
+# pages are shared (OS page cache) by all the processes that map the
+# same cache. a cache is valid while its oneh5 is unchanged (same path,
+# mtime and size, see cachekey). the default cache of x.oneh5 is
+# x.oneh5.mmap (see cachename); the oneh5 server keeps its data in the
+# same format.
+
+magic	 = 'YTLAMMAP'
+version	 = 1
+align	 = 4096			# alignment of the header and arrays (bytes)
+arrays	 = ['timestamp', 'auto', 'cross']
+
+
+def cachekey(fname):
+	# key of the current content of fname: its absolute path, mtime and size
+	st = os.stat(fname)
+	key = '%s:%r:%d' % (os.path.abspath(fname), st.st_mtime, st.st_size)
+	return hashlib.sha1(key).hexdigest()[:16]
+
+
+def cachename(h5name):
+	# the default cache file of h5name
+	return h5name + '.mmap'
+
+
+def _aligned(n):
+	return (n + align - 1) // align * align
+
+
+def wtcache(h5name, fcache=None, tblock=None):
+	# write the cache of h5name to fcache (default cachename(h5name)),
+	# block by block; the file appears under its name when complete.
+	# returns the cache name
+	from loadh5 import OneH5Reader
+	from blockreduce import blocks
+	from ytlatrace import span
+	if (fcache is None):
+		fcache = cachename(h5name)
+	sp = span('write cache', file=fcache)
+
+	with OneH5Reader(h5name, server=False) as r:
+		time = r.timestamp()
+		spec = [
+			('timestamp',	time.dtype,	time.shape),
+			('auto',	r.adtype,	(r.nsb, r.na, r.nch, r.ndata)),
+			('cross',	r.cdtype,	(r.nsb, r.nb, r.nch, r.ndata)),
+		]
+		head = {'version': version, 'source': os.path.abspath(h5name), 'key': cachekey(h5name), 'arrays': {}}
+		for (name, dtype, shape) in spec:
+			head['arrays'][name] = {'dtype': np.dtype(dtype).str, 'shape': list(shape), 'offset': 0}
+		# room for the digits of the offsets
+		hlen = _aligned(16 + len(json.dumps(head)) + 256)
+		offset = hlen
+		for (name, dtype, shape) in spec:
+			head['arrays'][name]['offset'] = offset
+			offset = _aligned(offset + np.dtype(dtype).itemsize * int(np.prod(shape)))
+		hjson = json.dumps(head)
+
+		tmp = fcache + '.tmp'
+		with open(tmp, 'wb') as f:
+			f.write(magic + np.array([len(hjson)], dtype='<u8').tostring() + hjson)
+			f.truncate(offset)
+
+		for (name, dtype, shape) in spec:
+			a = head['arrays'][name]
+			out = np.memmap(tmp, dtype=dtype, mode='r+', offset=a['offset'], shape=tuple(shape))
+			if (name == 'timestamp'):
+				out[:] = time
+			else:
+				for (t0, t1, blk) in blocks(r, name, tblock=tblock):
+					out[..., t0:t1] = blk
+					sp.add(blk.nbytes)
+			out.flush()
+			del out
+
+	os.rename(tmp, fcache)
+	sp.close()
+	return fcache
+
+
+def ldhead(fcache):
+	# the header of the cache fcache (None if it is not a cache)
+	with open(fcache, 'rb') as f:
+		if (f.read(len(magic)) != magic):
+			return None
+		n = int(np.fromstring(f.read(8), dtype='<u8')[0])
+		return json.loads(f.read(n))
+
+
+def ldcache(fcache, mode='c'):
+	# {'timestamp', 'auto', 'cross': memory maps} of the cache fcache
+	# mode = 'c' (copy-on-write: writing changes only the pages of this
+	# process) or 'r' (read-only)
+	head = ldhead(fcache)
+	if (head is None or head['version'] != version):
+		raise IOError('not a oneh5 cache (version %d): %s' % (version, fcache))
+	out = {}
+	for name in arrays:
+		a = head['arrays'][name]
+		out[name] = np.memmap(fcache, dtype=np.dtype(str(a['dtype'])), mode=mode,
+			offset=a['offset'], shape=tuple(a['shape']))
+	return out
+
+
+def opencache(h5name, fcache=None):
+	# the arrays of the cache of h5name (see ldcache) when it exists and
+	# is up to date, otherwise None
+	if (fcache is None):
+		fcache = cachename(h5name)
+	if (not os.path.isfile(fcache)):
+		return None
+	try:
+		head = ldhead(fcache)
+		if (head is None or head['key'] != cachekey(h5name)):
+			print 'cache %s is out of date, not used' % fcache
+			return None
+		return ldcache(fcache)
+	except (IOError, ValueError, KeyError) as e:
+		print 'error reading cache %s: %s' % (fcache, e)
+		return None
+
+
+
+if (__name__ == '__main__'):
+
+    inp = sys.argv[0:]
+    pg  = inp.pop(0)
+    usage = '''
+    write (or remove) the memory-mappable raw cache <oneh5>.mmap of
+    All-in-One h5 files; ldoneh5 and OneH5Reader use an up-to-date cache
+    instead of reading the file
+
+    %s <oneh5> [...] [options]
+
+	options are:
+	-rm		# remove the caches instead
+
+    ''' % pg
+
+    if (len(inp) < 1):
+	print usage
+	sys.exit()
+
+    remove = False
+    files = []
+    while (inp):
+	arg = inp.pop(0)
+	if (arg == '-rm'):
+	    remove = True
+	else:
+	    files.append(arg)
+
+    for fname in files:
+	fcache = cachename(fname)
+	if (remove):
+	    if (os.path.isfile(fcache)):
+		os.remove(fcache)
+		print 'removed', fcache
+	else:
+	    print 'writing', fcache
+	    wtcache(fname)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+import numpy as np
+import sys, os, os.path
+import json, socket, threading, tempfile
+import SocketServer
+from mmcache import cachekey, wtcache, ldcache
+
+# a local data server: a oneh5 file is loaded once into shared memory
+# (a raw cache in /dev/shm, see mmcache) and every tool that opens it gets
+# memory maps of the same pages, with no disk I/O.
+#
+#	oneh5_server.py &			start the server
+#	oneh5_server.py -load x.raw.oneh5	load a file ahead of time
+#	oneh5_server.py -stop			stop it, the shared memory is freed
+#
+# the loadh5 readers (ldoneh5, OneH5Reader) use the shared memory of a
+# file that was loaded (-load) when the server is running (see fetch);
+# opening a file never makes the server load it. the summaries, pyramid
+# and time index are still read from the file. the data of a file is keyed by its absolute
+# path, mtime and size, so a file that changed (e.g. grown by tloneh5) is
+# loaded again.
+#
+# the protocol is one JSON request and one JSON reply per connection,
+# each on one line:
+#	{"op": "load", "file": name}	--> {"ok": true, "cache": path}
+#	{"op": "get", "file": name}	--> {"ok": true, "cache": path|null}
+#	{"op": "list"}			--> {"ok": true, "files": [...]}
+#	{"op": "drop", "file": name}	--> {"ok": true}
+#	{"op": "stop"}			--> {"ok": true}
+# errors are {"ok": false, "error": message}
+
+sockname = os.environ.get('YTLA_SERVER', os.path.join(tempfile.gettempdir(), 'ytla_oneh5.%d.sock' % os.getuid()))
+shmdir	 = '/dev/shm' if (os.path.isdir('/dev/shm')) else tempfile.gettempdir()
+timeout	 = 5.		# max. wait of fetch for the server (s)
+
+
+def request(req, sock=None, wait=None):
+	# send the request req (a dict) to the server, return its reply;
+	# None if no server is running or it did not reply within wait
+	# seconds (None: no limit)
+	sock = sock or sockname
+	if (not os.path.exists(sock)):
+		return None
+	s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	s.settimeout(wait)
+	try:
+		s.connect(sock)
+		s.sendall(json.dumps(req) + '\n')
+		f = s.makefile('r')
+		line = f.readline()
+		f.close()
+	except socket.error:
+		return None
+	finally:
+		s.close()
+	if (not line):
+		return None
+	return json.loads(line)
+
+
+def fetch(fname, sock=None):
+	# {'timestamp', 'auto', 'cross': copy-on-write memory maps} of the
+	# oneh5 file fname from the server; None if no server is running
+	# (or it does not reply within timeout) or the file is not loaded
+	# there. writing into the maps only changes the pages of this process
+	if (os.environ.get('YTLA_SERVER') in ['0', 'off']):
+		return None
+	rep = request({'op': 'get', 'file': os.path.abspath(fname)}, sock, timeout)
+	if (rep is None):
+		return None
+	if (not rep['ok']):
+		print 'oneh5 server:', rep['error']
+		return None
+	if (rep['cache'] is None):
+		return None
+	try:
+		return ldcache(rep['cache'])
+	except (IOError, ValueError) as e:
+		print 'oneh5 server:', e
+		return None
+
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    # the server; files[key] = {'file': .., 'cache': path, 'nbytes': ..}
+    # loading[key]: an Event set when the copy of key is done
+    daemon_threads = True
+
+    def __init__(self, sock):
+	if (os.path.exists(sock)):
+	    os.remove(sock)
+	SocketServer.UnixStreamServer.__init__(self, sock, Handler)
+	os.chmod(sock, 0600)
+	self.sock = sock
+	self.files = {}
+	self.loading = {}
+	self.lock = threading.Lock()
+
+
+    def get(self, fname):
+	# the entry of fname if it is loaded (current version), else None
+	key = cachekey(fname)
+	with self.lock:
+	    return self.files.get(key)
+
+
+    def load(self, fname):
+	# the entry of fname, loaded into shared memory if needed. the copy
+	# is made outside the lock, so other requests are served meanwhile;
+	# a second load of the same file waits for it
+	from loadh5 import OneH5Reader
+	key = cachekey(fname)
+	with self.lock:
+	    if (key in self.files):
+		return self.files[key]
+	    done = self.loading.get(key)
+	    mine = (done is None)
+	    if (mine):
+		done = self.loading[key] = threading.Event()
+		# an older version of the same file is dropped
+		for k in [k for k in self.files if (self.files[k]['file'] == fname)]:
+		    self._remove(k)
+	if (not mine):
+	    done.wait()
+	    with self.lock:
+		if (key in self.files):
+		    return self.files[key]
+	    raise IOError('loading %s failed' % fname)
+
+	try:
+	    with OneH5Reader(fname, server=False) as r:
+		nbytes = r.ndata * 8 + (np.dtype(r.adtype).itemsize * r.na
+			+ np.dtype(r.cdtype).itemsize * r.nb) * r.nsb * r.nch * r.ndata
+	    st = os.statvfs(shmdir)
+	    if (nbytes > st.f_bavail * st.f_frsize):
+		raise IOError('not enough space in %s for %s (%.1f MB)' % (shmdir, fname, nbytes / 1048576.))
+
+	    print 'loading %s (%.1f MB)' % (fname, nbytes / 1048576.)
+	    sys.stdout.flush()
+	    path = wtcache(fname, os.path.join(shmdir, 'ytla.%s.mmap' % key))
+	    with self.lock:
+		self.files[key] = {'file': fname, 'cache': path, 'nbytes': nbytes}
+		return self.files[key]
+	finally:
+	    with self.lock:
+		del self.loading[key]
+	    done.set()
+
+
+    def _remove(self, key):
+	# free the shared memory of entry key (maps already open stay valid)
+	path = self.files.pop(key)['cache']
+	if (os.path.exists(path)):
+	    os.remove(path)
+
+
+    def drop(self, fname):
+	with self.lock:
+	    for k in [k for k in self.files if (self.files[k]['file'] == fname)]:
+		self._remove(k)
+
+
+    def cleanup(self):
+	with self.lock:
+	    for k in self.files.keys():
+		self._remove(k)
+	if (os.path.exists(self.sock)):
+	    os.remove(self.sock)
+
+
+
+class Handler(SocketServer.StreamRequestHandler):
+    # one request per connection
+
+    def handle(self):
+	try:
+	    req = json.loads(self.rfile.readline())
+	    op = req.get('op')
+	    if (op == 'load'):
+		e = self.server.load(req['file'])
+		rep = {'ok': True, 'cache': e['cache']}
+	    elif (op == 'get'):
+		e = self.server.get(req['file'])
+		rep = {'ok': True, 'cache': e['cache'] if (e) else None}
+	    elif (op == 'list'):
+		with self.server.lock:
+		    rep = {'ok': True, 'files': [(e['file'], e['nbytes']) for e in self.server.files.values()]}
+	    elif (op == 'drop'):
+		self.server.drop(req['file'])
+		rep = {'ok': True}
+	    elif (op == 'stop'):
+		rep = {'ok': True}
+		threading.Thread(target=self.server.shutdown).start()
+	    else:
+		rep = {'ok': False, 'error': 'unknown request: %s' % op}
+	except Exception as e:
+	    rep = {'ok': False, 'error': '%s: %s' % (e.__class__.__name__, e)}
+	self.wfile.write(json.dumps(rep) + '\n')
+
+
+
+if (__name__ == '__main__'):
+
+    inp = sys.argv[0:]
+    pg  = inp.pop(0)
+    usage = '''
+    serve oneh5 files from shared memory (%s) to the loadh5 readers
+
+    %s [options]		start the server (in the foreground)
+    %s -load <oneh5> [...]	load files into the running server
+    %s -list			list the loaded files
+    %s -drop <oneh5> [...]	free the memory of files
+    %s -stop			stop the server
+
+	options are:
+	-sock path		# socket of the server (default %s,
+				# or the environment variable YTLA_SERVER;
+				# YTLA_SERVER=off disables the clients)
+
+    ''' % (shmdir, pg, pg, pg, pg, pg, sockname)
+
+    sock = sockname
+    cmd = None
+    files = []
+    while (inp):
+	arg = inp.pop(0)
+	if (arg == '-sock'):
+	    sock = inp.pop(0)
+	elif (arg in ['-load', '-list', '-drop', '-stop']):
+	    cmd = arg[1:]
+	elif (arg in ['-h', '--help']):
+	    print usage
+	    sys.exit()
+	elif (cmd in ['load', 'drop']):
+	    files.append(os.path.abspath(arg))
+	else:
+	    print 'unknown option:', arg
+
+    if (cmd is None):
+	if (request({'op': 'list'}, sock) is not None):
+	    print 'a server is already running on', sock
+	    sys.exit(1)
+	srv = Server(sock)
+	print 'oneh5 server on %s, data in %s' % (sock, shmdir)
+	try:
+	    srv.serve_forever()
+	except KeyboardInterrupt:
+	    pass
+	finally:
+	    srv.cleanup()
+	sys.exit()
+
+    if (cmd == 'load'):
+	reqs = [{'op': 'load', 'file': f} for f in files]
+    elif (cmd == 'drop'):
+	reqs = [{'op': 'drop', 'file': f} for f in files]
+    else:
+	reqs = [{'op': cmd}]
+    for req in reqs:
+	rep = request(req, sock)
+	if (rep is None):
+	    print 'no server on', sock
+	    sys.exit(1)
+	if (not rep['ok']):
+	    print 'error:', rep['error']
+	elif (cmd == 'list'):
+	    for (fname, nbytes) in rep['files']:
+		print '%10.1f MB  %s' % (nbytes / 1048576., fname)
+	elif (cmd == 'load'):
+	    print 'loaded', req['file']
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+import numpy as np
+import h5py
+import sys, glob
+from loadh5 import *
+
+
+
+class OneH5Set(object):
+    # a set of All-in-One h5 files (e.g. the nights of a campaign) seen as
+    # one dataset along a common time axis.
+    # the timestamp range of every file is indexed once; a query opens only
+    # the files that overlap the requested time range tlim = [tmin, tmax]
+    # (absolute time, as in 'timestamp'; None = everything)
+
+    def __init__(self, fnames, precision=None):
+	# fnames: list of file names and/or glob patterns
+	self.precision = precision
+	self.readers = {}
+
+	files = []
+	for p in fnames:
+	    match = sorted(glob.glob(p))
+	    if (match):
+		files.extend(match)
+	    else:
+		print 'no file matches:', p
+
+	index = []
+	shape = None
+	for fname in files:
+	    with h5py.File(fname, 'r') as f:
+		ti = ldtindex(f)
+		if (ti.n == 0):
+		    print 'skip empty file:', fname
+		    continue
+		s = f['auto'].shape
+		if (shape is None):
+		    shape = s
+		elif (s[:3] != shape[:3]):
+		    print 'skip %s: shape %s differs from %s' % (fname, repr(s[:3]), repr(shape[:3]))
+		    continue
+		(t0, t1) = (ti.times([0, 1])[0], ti.times([ti.n-1, ti.n])[0])
+		index.append((t0, t1, ti.n, fname))
+	index.sort()
+
+	self.files  = [x[3] for x in index]
+	self.tstart = np.array([x[0] for x in index])
+	self.tstop  = np.array([x[1] for x in index])
+	self.ndata  = np.array([x[2] for x in index], dtype=int)
+	self.offset = np.concatenate(([0], np.cumsum(self.ndata)))	# global index of 1st point
+	if (shape is None):
+	    (self.nsb, self.na, self.nch) = (0, 0, 0)
+	else:
+	    (self.nsb, self.na, self.nch) = shape[:3]
+	self.nb = self.na * (self.na-1) / 2
+
+	for k in range(1, len(self.files)):
+	    if (self.tstart[k] <= self.tstop[k-1]):
+		print 'warning: %s overlaps %s in time' % (self.files[k], self.files[k-1])
+
+
+    def close(self):
+	for k in self.readers.keys():
+	    self.readers.pop(k).close()
+
+
+    def __enter__(self):
+	return self
+
+
+    def __exit__(self, *args):
+	self.close()
+
+
+    def reader(self, k):
+	# the OneH5Reader of file k, opened on first use
+	if (not k in self.readers):
+	    self.readers[k] = OneH5Reader(self.files[k], self.precision)
+	return self.readers[k]
+
+
+    def select(self, tlim=None):
+	# [(k, trange), ...] for the files overlapping tlim, trange being
+	# the [start, stop) integration range of file k inside tlim
+	if (tlim is None):
+	    return [(k, [0, self.ndata[k]]) for k in range(len(self.files))]
+
+	(tmin, tmax) = tlim
+	# files are sorted by time: first file ending after tmin,
+	# last file starting before tmax
+	k0 = np.searchsorted(self.tstop, tmin, side='left')
+	k1 = np.searchsorted(self.tstart, tmax, side='right')
+	sel = []
+	for k in range(k0, k1):
+	    (i0, i1) = self.reader(k).trange(tlim)
+	    if (i1 > i0):
+		sel.append((k, [i0, i1]))
+	return sel
+
+
+    def timestamp(self, tlim=None):
+	sel = self.select(tlim)
+	if (not sel):
+	    return np.zeros(0)
+	return np.concatenate([self.reader(k).timestamp(tr) for (k, tr) in sel])
+
+
+    def vis(self, sb, anti, antj, chrange=None, tlim=None):
+	# vis(sb, anti, antj) of all files overlapping tlim, joined in time
+	sel = self.select(tlim)
+	if (not sel):
+	    return None
+	return np.concatenate([self.reader(k).vis(sb, anti, antj, chrange, tr) for (k, tr) in sel], axis=-1)
+
+
+    def chavg(self, xtype, chlim, tlim=None):
+	# xtype channel-averaged over chlim --> (nsb, nb|na, npt), joined in time
+	sel = self.select(tlim)
+	if (not sel):
+	    return None
+	return np.concatenate([self.reader(k).chavg(xtype, chlim, tr) for (k, tr) in sel], axis=-1)
+
+
+    def tavg(self, xtype, tlim=None):
+	# xtype time-averaged over all integrations in tlim --> (nsb, nb|na, nch)
+	# (accumulated in double precision)
+	sel = self.select(tlim)
+	if (not sel):
+	    return None
+	acc = 0.
+	npt = 0
+	for (k, tr) in sel:
+	    n = tr[1] - tr[0]
+	    acc = acc + self.reader(k).tavg(xtype, tr).astype(np.complex128 if (xtype == 'cross') else np.float64) * n
+	    npt += n
+	return acc / float(npt)
+
+
+
+if (__name__ == '__main__'):
+
+    inp = sys.argv[0:]
+    pg  = inp.pop(0)
+    usage = '''
+    list the time index of a set of All-in-One h5 files
+
+    %s <oneh5_file_or_pattern> [...]
+
+    ''' % pg
+
+    if (len(inp) < 1):
+	print usage
+	sys.exit()
+
+    with OneH5Set(inp) as ds:
+	print 'nsb, na, nch =', ds.nsb, ds.na, ds.nch
+	for k in range(len(ds.files)):
+	    print '%s  %.3f  %.3f  %d' % (ds.files[k], ds.tstart[k], ds.tstop[k], ds.ndata[k])
+	print 'total: %d integrations in %d files' % (ds.offset[-1], len(ds.files))
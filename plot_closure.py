@@ -4,10 +4,16 @@ import sys
 import os.path
 from loadh5 import *	# import ldoneh5() <-- function; and also (nsb, nch) <-- variables
 from drawpdf import *
+import ytlatrace
+import blockreduce
+from ytlatrace import span
+from visdata import *
+from blockreduce import Reducer, run
+from functools import partial
 
 
 #-- defaults --
-inp	= sys.argv[0:]
+inp	= blockreduce.argv(ytlatrace.argv(sys.argv[0:]))
 pg	= inp.pop(0)
 chlim	= [5, 750]		# channel range to avg
 tlim	= []			# time    range to avg AND plot (sec)
@@ -31,6 +37,8 @@ syntax: %s <All-in-One_H5> [options]
 				# or individually auto-determined (%s)
 	-cyr cymin cymax	# set a fixed yrange for amp-channel plots
 	-tyr tymin tymax	# set a fixed yrange for amp-time plots
+	-j N			# reduce on N processes (default 1)
+	-trace [f.json]		# time the phases (summary table, JSON trace to f.json)
 
 ''' % (pg, chlim[0], chlim[1], ys)
 
@@ -109,28 +117,8 @@ fplt = dname + '/' + fbase
 
 
 
-#-- load full data --
-print 'loading data'
-(time, auto, cross) = ldoneh5(foneh5)
-t2 = time - time[0]
-
-## construct array range from time limit
-if (tset):
-	tw = np.logical_and(t2 >= tmin, t2 <= tmax)
-else:
-	tw = np.ones(time.size, dtype=bool)
-
-## over-load the arrays according to time range
-t2    = t2[tw]
-auto  = auto[:,:,:,tw]
-cross = cross[:,:,:,tw]
-
-
-
-#-- make the plots --
-
-
-(nsb, na, nch, ndata) = auto.shape
+r = OneH5Reader(foneh5)
+(nsb, na, nch) = (r.nsb, r.na, r.nch)
 if (na < 3):
 	print "closure phase needs at least 3 antennas."
 	sys.exit()
@@ -140,43 +128,46 @@ nb = na * (na - 1) / 2
 w = ['lsb', 'usb']
 
 ch = np.array(range(nch))
-close = np.ones((nsb, na, nch, ndata), dtype = complex)
+bi = BaselineIndex(na)
 
-bn = {}
-b = -1
-for ai in range(na-1):
-	for aj in range(ai+1, na):
-		b += 1
-		bl = '%d%d' % (ai, aj)
-		bn[bl] = b
+## closure w/o ant i: triangle of the first 3 other antennas (a0, a1, a2)
+## = (a0,a1) * (a1,a2) * (a0,a2)*, all na triangles at once
+tri = np.array([[a for a in range(na) if (a != i)][:3] for i in range(na)])
 
-ant = range(na)
 sptitle = []
 for i in range(na):
-	a_use = ant[:]
-	a_use.pop(i)
-	print len(a_use), a_use
-	title = ''
+	print i, tri[i]
+	sptitle.append('%s %s %s*' % (bi.name(bi.bl[tri[i,0], tri[i,1]]),
+		bi.name(bi.bl[tri[i,1], tri[i,2]]), bi.name(bi.bl[tri[i,0], tri[i,2]])))
 
-	bl = '%d%d' % (a_use[0], a_use[1])
-	title += (bl + ' ')
-	print bn[bl]
-	close[:,i,:,:] *= cross[:,bn[bl],:,:]
 
-	bl = '%d%d' % (a_use[1], a_use[2])
-	title += (bl + ' ')
-	print bn[bl]
-	close[:,i,:,:] *= cross[:,bn[bl],:,:]
-
-	bl = '%d%d' % (a_use[0], a_use[2])
-	title += (bl + '*')
-	print bn[bl]
-	close[:,i,:,:] *= cross[:,bn[bl],:,:].conjugate()
+#-- closure averages --
+## the closure products are formed and averaged block by block
+## (see blockreduce), the full cube is never loaded
+print 'averaging closures'
+time = r.timestamp()
+t2 = time - time[0]
+if (tset):
+	trange = r.trange([time[0] + tmin, time[0] + tmax])
+else:
+	trange = [0, len(t2)]
+if (trange[1] <= trange[0]):
+	print 'error: no integration in tlim [%s, %s] (data: 0 - %.3f s), no plots made' % (tmin, tmax, t2[-1])
+	r.close()
+	sys.exit()
+t2 = t2[trange[0]:trange[1]]
 
-	sptitle.append(title)
+sp = span('closure')
+(close_ta, close_ca) = run(r, 'cross', [Reducer((3,)), Reducer((2,), chrange=[5,750])],
+	pre = partial(closure, tri=tri), trange = trange)
+close_ta = close_ta['mean']
+close_ca = close_ca['mean']
+r.close()
+sp.close()
 
 
 ## channel plots (time_avg)
+sp = span('plot')
 fout = fplt + '.closure-chan.pdf'
 plt.figure(figsize = (12,9))
 for sb in range(nsb):
@@ -184,7 +175,7 @@ for sb in range(nsb):
 		s = i + 1
 
 		plt.subplot(m, n, s)
-		plt.plot(ch, np.angle(close[sb,i].mean(axis=1)), ',', label=w[sb])
+		plt.plot(ch, np.angle(close_ta[sb,i]), ',', label=w[sb])
 		#plt.title('closure w/o ant%d' % i)
 		plt.title(sptitle[i])
 		plt.xlabel('chanel')
@@ -203,7 +194,7 @@ for sb in range(nsb):
 		s = i + 1
 
 		plt.subplot(m, n, s)
-		plt.plot(t2, np.angle(close[sb,i][5:750,:].mean(axis=0)), ',', label=w[sb])
+		plt.plot(t2, np.angle(close_ca[sb,i]), ',', label=w[sb])
 		#plt.title('closure w/o ant%d' % i)
 		plt.title(sptitle[i])
 		plt.xlabel('time')
@@ -212,4 +203,5 @@ for sb in range(nsb):
 
 plt.savefig(fout)
 plt.close()
+sp.close()
 
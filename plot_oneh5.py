@@ -4,14 +4,18 @@ import sys
 import os.path
 from loadh5 import *	# import ldoneh5() <-- function; and also (nsb, nch) <-- variables
 from drawpdf import *
+import ytlatrace
+import blockreduce
+from blockreduce import Reducer, run, gainslope
+from functools import partial
 
 
 #-- defaults --
-inp	= sys.argv[0:]
+inp	= blockreduce.argv(ytlatrace.argv(sys.argv[0:]))
 pg	= inp.pop(0)
 na	= 7
 nb	= na * (na-1) / 2
-chlim	= [20, 760]		# channel range to avg
+chlim	= list(sumch)		# channel range to avg
 tlim	= []			# time    range to avg AND plot (sec)
 ys	= 'common'		# amp plot mode
 				# 'common' = min/max range of all sub-plots
@@ -36,6 +40,8 @@ syntax: %s <All-in-One_H5> [options]
 	-logy			# set y-scale of amp-channel plots to log-scale
 	-cyr cymin cymax	# set a fixed yrange for amp-channel plots
 	-tyr tymin tymax	# set a fixed yrange for amp-time plots
+	-j N			# reduce on N processes (default 1)
+	-trace [f.json]		# time the phases (summary table, JSON trace to f.json)
 	-gs  gain-slope		# correct gain-slope, in dB, across full channel range
 
 ''' % (pg, chlim[0], chlim[1], ys)
@@ -125,22 +131,39 @@ else:
 
 
 
-#-- load full data --
-print 'loading data'
-(time, auto, cross) = ldoneh5(foneh5)
-
+fout = fplt + '.pdf'
 
+#-- load the time/channel averages only --
+## stored summaries are used when made with the same ranges, otherwise
+## the data is averaged block by block (see blockreduce)
+print 'loading averages'
+with OneH5Reader(foneh5) as r:
+	time = r.timestamp()
+	t2 = time - time[0]
+	if (tlim):
+		trange = r.trange([time[0] + tlim[0], time[0] + tlim[1]])
+	else:
+		trange = [0, len(t2)]
+	if (trange[1] <= trange[0]):
+		print 'error: no integration in tlim', tlim, '(data: 0 - %.3f s), %s not made' % (t2[-1], fout)
+		sys.exit()
+	auto_ta  = r.tavg('auto', trange)
+	auto_ca  = r.chavg('auto', chlim, trange)
+	if (gs == 0.):
+		cross_ta = r.tavg('cross', trange)
+		cross_ca = r.chavg('cross', chlim, trange)
+	else:
+		## the gain slope is applied to each block before averaging
+		(ta, ca) = run(r, 'cross', [Reducer((3,)), Reducer((2,), chrange=chlim)],
+			pre = partial(gainslope, gs=gs), trange = trange)
+		cross_ta = ta['mean']
+		cross_ca = ca['mean']
 
 
 #-- make the plots --
-
-fout = fplt + '.pdf'
-
-corr2pdf(fout, time, auto, cross,
+sum2pdf(fout, t2[trange[0]:trange[1]], auto_ta, cross_ta, auto_ca, cross_ca,
 	ys = ys, logy = logy,
-	tlim = tlim, chlim = chlim,
-	cylim = cylim, tylim = tylim,
-	gs = gs
+	cylim = cylim, tylim = tylim
 )
 
 
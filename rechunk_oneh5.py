@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+import numpy as np
+import h5py
+import sys, os, os.path
+import time as systime
+from loadh5 import *
+import ytlatrace
+from ytlatrace import span
+import blockreduce
+
+
+# rewrite All-in-One h5 files with auto/cross chunks laid out for an
+# access pattern:
+#	time	time series per baseline: chunks of chchunk channels x
+#		tchunk integrations (the vs-time plots, chavg, track2sefd)
+#	spec	spectrum per integration: all channels x a few
+#		integrations (the vs-chan plots, tavg)
+# everything else in the file (attrs, timestamps, summaries, pyramid,
+# passband, ...) is copied as is. the data is copied one baseline at a
+# time in blocks aligned to the chunks, then compared bit for bit with
+# the original. the read time of the GUI paths is reported before and
+# after (see readbench).
+layouts = {
+	'time':	{'tchunk': 1024, 'chchunk': 64},
+	'spec':	{'tchunk': 16, 'chchunk': nch},
+}
+dnames	= ['auto', 'cross', 'cross_real', 'cross_imag']	# the cube datasets
+
+
+def rechunk(h5in, h5out, mode='time', **kwargs):
+	# write h5in to h5out with the layout mode (see layouts);
+	# kwargs override the layout and set the compression (tchunk,
+	# chchunk, compression, clevel, shuffle; see crtoneh5)
+	opts = dict(layouts[mode])
+	opts.update(kwargs)
+	sp = span('rechunk', file=h5in, mode=mode)
+
+	## stored dtype, never converted
+	with OneH5Reader(h5in, server=False) as r:
+		fi = r.f
+		dopts = dsopts(r.nch, r.ndata, **opts)
+		fo = h5py.File(h5out, 'w')
+		for k in fi.attrs:
+			if (k != 'layout'):		# a vds file becomes a plain one
+				fo.attrs[k] = fi.attrs[k]
+		fo.attrs['version'] = oneh5_version
+		for k in fi:
+			if (not k in dnames):
+				fi.copy(k, fo)
+
+		da = fo.create_dataset('auto',  r.shape, dtype=r.adtype, **dopts)
+		dc = fo.create_dataset('cross', (r.nsb, r.nb, r.nch, r.ndata), dtype=r.cdtype, **dopts)
+		print '...  chunks', dopts['chunks'][2:], 'compression', dopts.get('compression')
+
+		## one baseline at a time, blocks of whole chunks in time
+		tblock = _tblock(r, dopts['chunks'][3])
+		for sb in range(r.nsb):
+			for (d, n, get) in [(da, r.na, r.auto), (dc, r.nb, r.cross)]:
+				for b in range(n):
+					for t0 in range(0, r.ndata, tblock):
+						t1 = min(t0 + tblock, r.ndata)
+						blk = get(sb, b, None, [t0, t1])
+						d[sb, b, :, t0:t1] = blk
+						sp.add(blk.nbytes)
+		fo.close()
+	sp.close()
+
+
+def _tblock(r, tc=1):
+	# integrations per block of one baseline of the reader r: a multiple
+	# of tc, below blockreduce.blockmem
+	itemsize = np.dtype(r.cdtype).itemsize
+	return max(1, blockreduce.blockmem // (itemsize * r.nch * tc)) * tc
+
+
+def _same(a, b):
+	# bit-for-bit equality (NaN included)
+	a = np.ascontiguousarray(a)
+	b = np.ascontiguousarray(b)
+	return a.dtype == b.dtype and a.shape == b.shape and np.array_equal(a.view(np.uint8), b.view(np.uint8))
+
+
+def verify(h5ref, h5test):
+	# True if timestamps, auto and cross of h5test are bit-for-bit those
+	# of h5ref; read one baseline at a time, in blocks (see rechunk)
+	sp = span('verify', file=h5test)
+	with OneH5Reader(h5ref, server=False) as rr:
+		with OneH5Reader(h5test, server=False) as rt:
+			if (rt.shape != rr.shape or not _same(rt.timestamp(), rr.timestamp())):
+				print 'error: shape or timestamps differ'
+				sp.close()
+				return False
+			tblock = _tblock(rr)
+			for sb in range(rr.nsb):
+				for (xtype, n) in [('auto', rr.na), ('cross', rr.nb)]:
+					get = [getattr(r, xtype) for r in (rr, rt)]
+					for b in range(n):
+						for t0 in range(0, rr.ndata, tblock):
+							tr = [t0, min(t0 + tblock, rr.ndata)]
+							blk = get[0](sb, b, None, tr)
+							if (not _same(blk, get[1](sb, b, None, tr))):
+								print 'error: %s[%d, %d] differs' % (xtype, sb, b)
+								sp.close()
+								return False
+							sp.add(blk.nbytes)
+	sp.close()
+	return True
+
+
+def readbench(h5name, nbl=6, chlim=sumch, twin=0.1):
+	# read time (s) and rate (MB/s) of the GUI paths, on the first nbl
+	# baselines (cross) of sideband 0:
+	#	vs-time		channels chlim, all integrations
+	#	vs-chan		all channels, a window of twin x all integrations
+	#	baseline	the full baseline (dataRebin)
+	# read from the file (not the oneh5 server or cache); the OS page
+	# cache is not flushed, so repeated reads of a small file are warm
+	res = {}
+	with OneH5Reader(h5name, server=False) as r:
+		nbl = min(nbl, r.nb)
+		nt = max(1, int(r.ndata * twin))
+		t0 = (r.ndata - nt) // 2
+		paths = [
+			('vs-time',	chlim,	None),
+			('vs-chan',	None,	[t0, t0 + nt]),
+			('baseline',	None,	None),
+		]
+		for (name, cr, tr) in paths:
+			nbytes = 0
+			t = systime.time()
+			for b in range(nbl):
+				nbytes += r.cross(0, b, cr, tr).nbytes
+			dt = systime.time() - t
+			res[name] = (dt, nbytes / 1048576. / max(dt, 1e-9))
+	return res
+
+
+def _prbench(label, res):
+	print '%-8s' % label + ''.join(['  %s %7.3f s %8.1f MB/s' % (k, res[k][0], res[k][1]) for k in ['vs-time', 'vs-chan', 'baseline']])
+
+
+
+if (__name__ == '__main__'):
+
+    inp = ytlatrace.argv(sys.argv[0:])
+    pg  = inp.pop(0)
+    usage = '''
+    rewrite All-in-One h5 files with auto/cross chunked for an access
+    pattern; the result is verified bit for bit and replaces the file
+    (unless -o), the read times of the GUI paths are reported
+
+    %s <oneh5> [...] [options]
+
+	options are:
+	-mode time|spec	# time series per baseline (default) or
+			# spectrum per integration
+	-tchunk N	# integrations per chunk (time: %d, spec: %d)
+	-chchunk N	# channels per chunk (time: %d, spec: all)
+	-gzip level	# gzip-compress auto/cross (level 0-9)
+	-lzf		# lzf-compress auto/cross
+	-noshuffle	# no shuffle filter before compression
+	-o out.oneh5	# write to out.oneh5, keep the original (one input only)
+	-noverify	# skip the bit-for-bit check
+	-nobench	# skip the read benchmark
+	-trace [f.json]	# time the phases (summary table, JSON trace to f.json)
+
+    ''' % (pg, layouts['time']['tchunk'], layouts['spec']['tchunk'], layouts['time']['chchunk'])
+
+    if (len(inp) < 1):
+	print usage
+	sys.exit()
+
+    mode = 'time'
+    opts = {}
+    fout = None
+    check = True
+    bench = True
+    files = []
+    while (inp):
+	arg = inp.pop(0)
+	try:
+	    if (arg == '-mode'):
+		mode = inp.pop(0)
+		if (not mode in layouts):
+		    print 'unknown mode: %s' % mode
+		    sys.exit(1)
+	    elif (arg == '-tchunk'):
+		opts['tchunk'] = int(inp.pop(0))
+	    elif (arg == '-chchunk'):
+		opts['chchunk'] = int(inp.pop(0))
+	    elif (arg == '-gzip'):
+		opts['compression'] = 'gzip'
+		opts['clevel'] = int(inp.pop(0))
+	    elif (arg == '-lzf'):
+		opts['compression'] = 'lzf'
+	    elif (arg == '-noshuffle'):
+		opts['shuffle'] = False
+	    elif (arg == '-o'):
+		fout = inp.pop(0)
+	    elif (arg == '-noverify'):
+		check = False
+	    elif (arg == '-nobench'):
+		bench = False
+	    elif (arg.startswith('-')):
+		print 'unknown option:', arg
+	    else:
+		files.append(arg)
+	except (ValueError, IndexError):
+	    print 'error reading option:', arg
+
+    if (fout is not None and len(files) > 1):
+	print 'error: -o with more than one input file'
+	sys.exit(1)
+
+    for fname in files:
+	out = fout if (fout is not None) else fname + '.rechunk.tmp'
+	print 'rechunking %s --> %s (%s)' % (fname, out, mode)
+	if (bench):
+	    before = readbench(fname)
+	rechunk(fname, out, mode, **opts)
+
+	if (check):
+	    if (verify(fname, out)):
+		print '...  verified: identical'
+	    else:
+		print 'error: %s differs from %s, %s is kept' % (out, fname, fname)
+		continue
+
+	print '...  size %.1f MB --> %.1f MB' % (os.path.getsize(fname) / 1048576., os.path.getsize(out) / 1048576.)
+	if (fout is None):
+	    os.rename(out, fname)
+	    out = fname
+
+	if (bench):
+	    after = readbench(out)
+	    _prbench('before', before)
+	    _prbench('after', after)
@@ -5,18 +5,23 @@ mpl.use('Agg')
 import matplotlib.pyplot as plt
 import sys
 from loadh5 import *
+from visdata import *
+import ytlatrace
+import blockreduce
+from ytlatrace import span
 from subprocess import call
 
 
 
 #-- defaults --
-inp	= sys.argv[0:]
+inp	= blockreduce.argv(ytlatrace.argv(sys.argv[0:]))
 pg	= inp.pop(0)
 na      = 7
-nb      = na * (na - 1) / 2
+bi      = BaselineIndex(na)
+nb      = bi.nb
 #tint    = 0.678                 # integration time used for SEFD calculation
-bw      = 1.6 * (720./1024.)    # bandwidth used for SEFD calculation
-chlim	= [20, 740]
+chlim	= list(sefdch)		# channel range of the SEFD (stored summary, see smoneh5)
+bw      = 1.6 * ((chlim[1] - chlim[0]) / 1024.)    # bandwidth used for SEFD calculation
 
 
 
@@ -31,6 +36,10 @@ syntax
         <planet_flux>   the source flux in Jy (for SEFD calculation)
         <tint>          integration time per data point
 
+    option
+	-j N	reduce on N processes (default 1)
+	-trace [f.json]	time the phases (summary table, JSON trace to f.json)
+
 NOTE:
     if some antenna is not working, it can be flagged in the config file 'ant_flag.config'
     put a single row of 1 (n_ant elements) if all antennas are working
@@ -82,10 +91,22 @@ else:
 
 
 #-- load data --
-(time, auto, cross) = ldoneh5(foneh5)
+## only the channel-averaged cross is needed (stored in the file when
+## made with the same chlim, otherwise averaged block by block)
+with OneH5Reader(foneh5) as r:
+    time = r.timestamp()
+    print (r.nsb, r.nb, r.nch, r.ndata)
+    ca_cross = r.chavg('cross', chlim)
 t = time - time[0]
-print cross.shape
-ca_cross = cross[:,:,chlim[0]:chlim[1],:].mean(axis=2)
+
+## the array size is that of the data
+if (r.na != na):
+    na = r.na
+    bi = BaselineIndex(na)
+    nb = bi.nb
+if (len(goodAnt) != na):
+    print 'warning: %s has %d antennas, data has %d. all antennas used.' % (fconf, len(goodAnt), na)
+    goodAnt = np.ones(na, dtype='int')
 
 ton, toff = np.loadtxt(ftiming, usecols=(0,1), unpack=True)
 npatch = len(ton)
@@ -100,11 +121,8 @@ if (do_check):
 	    sb = 'lsb'
 	else:
 	    sb = 'usb'
-	b = -1
-	for ai in range(na-1):
-	    for aj in range(ai+1, na):
-		b += 1
-		bl = '%d%d' % (ai, aj)
+	for b in range(nb):
+		bl = bi.name(b)
 		print bl
 		fout = '%s/bl%s.%s_time' % (folder, bl, sb)
 		with open(fout, 'w') as f:
@@ -119,6 +137,7 @@ for s in range(2):
 	sb = 'lsb'
     else:
 	sb = 'usb'
+    sp = span('sefd', sb=sb)
 
 
     #-- prepare plots
@@ -128,7 +147,7 @@ for s in range(2):
     w = np.logical_and(t>=ton[1], t<=toff[npatch-2])
     tc = (ton[1] + toff[npatch-2]) / 2.
 
-    for b in range(21):
+    for b in range(nb):
 	subs[1].plot(t[w], np.abs(ca_cross[s,b,w]))
     subs[1].set_xlabel('time (sec)')
     subs[1].set_ylabel('bl. amplitude')
@@ -185,14 +204,8 @@ for s in range(2):
 	peak = avga / rms	# 21 baselines (for 7-element)
 	#print 'normalized', peak
 
-	b = -1
-	for ai in range(na-1):
-	    for aj in range(ai+1, na):
-		b += 1
-		if (goodAnt[ai] and goodAnt[aj]):
-		    pass
-		else:
-		    peak[b] = 1.e-30    # an arbitrarily small positive number
+	goodBl = bi.select(goodAnt)
+	peak[~goodBl] = 1.e-30    # an arbitrarily small positive number
 
 	#print "adjusted peak = ", peak
 	print >> out, "peak power (corrected for misalignment attenuation) <-- per baseline"
@@ -212,20 +225,9 @@ for s in range(2):
 	## here the equations are
 	## log(Pi) + log(Pj) = log(Pij)
 
-	sh = (nb, na)
-	A = np.zeros(sh)
-	b = -1
-	for i in range(na-1):
-	    for j in range(i+1, na):
-		b += 1
-		#print i, j, b
-		if (goodAnt[i] and goodAnt[j]):
-		    A[b][i] = 0.5
-		    A[b][j] = 0.5
-		else:
-		    A[b][i] = 0.
-		    A[b][j] = 0.
-		    D[b] = 0.
+	A = 0.5 * bi.incidence()
+	A[~goodBl] = 0.
+	D[~goodBl] = 0.
 
 
 	print >> out, "solve X in (A dot X = D)\n"
@@ -282,6 +284,7 @@ for s in range(2):
     fig.suptitle('%s, %s' % (foneh5, sb))
     fig.savefig('%s.png' % flog)
     plt.close(fig)
+    sp.close()
 
 
 
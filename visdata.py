@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import numpy as np
+
+
+
+class BaselineIndex(object):
+    # precomputed index tables of the baselines of na antennas, in the
+    # order of the correlator files (and of ldcorr/oneh5):
+    #	b = 0, 1, ... nb-1 for (0,1), (0,2), ... (0,na-1), (1,2), ...
+    #
+    #	ant1[b], ant2[b]	antenna pair of baseline b (ant1 < ant2)
+    #	bl[i, j]		baseline of the pair (i, j), either order;
+    #				-1 for i == j
+    #	conj[i, j]		True if (i, j) is the conjugate of bl[i, j]
+    #				(i.e. i > j)
+    # all tables are numpy arrays, so that arrays of antennas or baselines
+    # can be looked up at once
+    __slots__ = ('na', 'nb', 'ant1', 'ant2', 'bl', 'conj')
+
+    def __init__(self, na):
+	self.na = na
+	self.nb = na * (na-1) / 2
+	(self.ant1, self.ant2) = np.triu_indices(na, 1)
+	b = np.arange(self.nb)
+	self.bl = -np.ones((na, na), dtype=int)
+	self.bl[self.ant1, self.ant2] = b
+	self.bl[self.ant2, self.ant1] = b
+	self.conj = np.zeros((na, na), dtype=bool)
+	self.conj[self.ant2, self.ant1] = True
+
+
+    def name(self, b, fmt='%d%d'):
+	# name(s) of baseline(s) b, e.g. '01'
+	if (np.ndim(b) == 0):
+	    return fmt % (self.ant1[b], self.ant2[b])
+	return [fmt % (self.ant1[k], self.ant2[k]) for k in b]
+
+
+    def select(self, good):
+	# mask of the baselines whose two antennas are both good
+	# good: mask (or 0/1 flags) over the na antennas
+	good = np.asarray(good, dtype=bool)
+	return np.logical_and(good[self.ant1], good[self.ant2])
+
+
+    def incidence(self):
+	# (nb, na) matrix, 1 where antenna a is part of baseline b
+	A = np.zeros((self.nb, self.na))
+	b = np.arange(self.nb)
+	A[b, self.ant1] = 1.
+	A[b, self.ant2] = 1.
+	return A
+
+
+
+def _pairs(cross, bi, anti, antj):
+	# cross (nsb, nb, ...) of the antenna pairs (anti[k], antj[k]),
+	# conjugated where anti > antj --> (nsb, npair, ...)
+	anti = np.asarray(anti)
+	antj = np.asarray(antj)
+	v = cross[:, bi.bl[anti, antj]]
+	c = bi.conj[anti, antj]
+	if (c.any()):
+		v[:, c] = v[:, c].conjugate()
+	return v
+
+
+def closure(cross, tri):
+	# closure products (a0,a1) * (a1,a2) * (a2,a0) of the triangles
+	# tri (ntri, 3) from cross (nsb, nb, nch, ndata), e.g. a time block
+	# --> (nsb, ntri, nch, ndata)
+	na = int(round((1. + np.sqrt(1. + 8. * cross.shape[1])) / 2.))
+	bi = BaselineIndex(na)
+	tri = np.asarray(tri)
+	return _pairs(cross, bi, tri[:,0], tri[:,1]) * _pairs(cross, bi, tri[:,1], tri[:,2]) * _pairs(cross, bi, tri[:,2], tri[:,0])
+
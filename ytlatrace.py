@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+import sys, os
+import time, json, resource, atexit
+
+# named spans recording the duration, bytes moved and memory of a phase
+#
+#	with span('read file', file=fname) as sp:
+#		...
+#		sp.add(arr.nbytes)
+# or, around longer code:
+#	sp = span('write dataset')
+#	...
+#	sp.close(nbytes)
+#
+# tracing is off unless enabled by the environment variable
+#	YTLA_TRACE=1		summary table on stderr at exit
+#	YTLA_TRACE=trace.json	summary table + JSON trace of every span
+# or the -trace [trace.json] option of the tools (see argv).
+# when off, span() returns a shared do-nothing span.
+
+enabled = False
+ftrace	= None		# JSON trace file, None = summary table only
+_spans	= []		# finished spans (dicts)
+_depth	= [0]		# nesting level of the open spans
+_t0	= time.time()
+
+
+def _procio():
+	# (rchar, wchar) of this process from /proc/self/io (Linux), else zeros
+	try:
+		with open('/proc/self/io') as f:
+			io = dict([line.split(':') for line in f.read().split('\n') if (':' in line)])
+		return (int(io['rchar']), int(io['wchar']))
+	except (IOError, KeyError, ValueError):
+		return (0, 0)
+
+
+def _rss():
+	# current resident memory (MB) from /proc/self/statm, else the peak
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * resource.getpagesize() / 1048576.
+	except (IOError, IndexError, ValueError):
+		return _peak()
+
+
+def _peak():
+	# peak resident memory of the process so far (MB)
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class Span(object):
+    # one timed phase; see span()
+
+    def __init__(self, name, **info):
+	self.name = name
+	self.info = info
+	self.nbytes = 0
+	self.closed = False
+	self.depth = _depth[0]
+	_depth[0] += 1
+	self.io0 = _procio()
+	self.rss0 = _rss()
+	self.t0 = time.time()
+
+
+    def add(self, nbytes):
+	# account for nbytes moved (read, built or written) in this span
+	self.nbytes += int(nbytes)
+
+
+    def close(self, nbytes=0):
+	if (self.closed):
+	    return
+	self.closed = True
+	self.add(nbytes)
+	dt = time.time() - self.t0
+	io = _procio()
+	rss = _rss()
+	_depth[0] -= 1
+	rec = {
+		'name':		self.name,
+		'depth':	self.depth,
+		'start':	self.t0 - _t0,
+		'dur':		dt,
+		'nbytes':	self.nbytes,
+		'rchar':	io[0] - self.io0[0],
+		'wchar':	io[1] - self.io0[1],
+		'rss_mb':	rss,
+		'drss_mb':	rss - self.rss0,
+		'peak_mb':	_peak(),
+	}
+	rec.update(self.info)
+	_spans.append(rec)
+
+
+    def __enter__(self):
+	return self
+
+
+    def __exit__(self, *args):
+	self.close()
+
+
+class _NoSpan(object):
+    # the span of disabled tracing
+
+    def add(self, nbytes):
+	pass
+
+
+    def close(self, nbytes=0):
+	pass
+
+
+    def __enter__(self):
+	return self
+
+
+    def __exit__(self, *args):
+	pass
+
+_nospan = _NoSpan()
+
+
+def span(name, **info):
+	# start a span; extra keywords (e.g. file=...) go into the trace
+	if (enabled):
+		return Span(name, **info)
+	return _nospan
+
+
+def enable(fname=None):
+	# turn tracing on; summary (and JSON trace to fname) at exit
+	global enabled, ftrace
+	if (not enabled):
+		atexit.register(report)
+	enabled = True
+	if (fname):
+		ftrace = fname
+
+
+def argv(inp):
+	# remove '-trace [trace.json]' from the argument list inp (in place)
+	# and enable tracing accordingly
+	if (not '-trace' in inp):
+		return inp
+	k = inp.index('-trace')
+	inp.pop(k)
+	if (k < len(inp) and inp[k].endswith('.json')):
+		enable(inp.pop(k))
+	else:
+		enable()
+	return inp
+
+
+def summary(out=sys.stderr):
+	# per span name: count, total time, MB moved/read/written, peak memory
+	if (not _spans):
+		return
+	names = []
+	tot = {}
+	for r in _spans:
+		if (not r['name'] in tot):
+			names.append(r['name'])
+			tot[r['name']] = [0, 0., 0, 0, 0, 0.]
+		t = tot[r['name']]
+		t[0] += 1
+		t[1] += r['dur']
+		t[2] += r['nbytes']
+		t[3] += r['rchar']
+		t[4] += r['wchar']
+		t[5] = max(t[5], r['peak_mb'])
+	print >> out, '%-24s %5s %9s %9s %9s %9s %9s' % ('span', 'n', 'time(s)', 'data(MB)', 'read(MB)', 'wrt(MB)', 'peak(MB)')
+	for name in names:
+		t = tot[name]
+		print >> out, '%-24s %5d %9.3f %9.1f %9.1f %9.1f %9.1f' % (name[:24], t[0], t[1],
+			t[2]/1048576., t[3]/1048576., t[4]/1048576., t[5])
+
+
+def report():
+	# the summary table, and the JSON trace when a file is set
+	summary()
+	if (ftrace):
+		with open(ftrace, 'w') as f:
+			json.dump({'argv': sys.argv, 'pid': os.getpid(), 'spans': _spans}, f, indent=1)
+		print >> sys.stderr, 'trace saved in', ftrace
+
+
+_env = os.environ.get('YTLA_TRACE', '')
+if (_env and _env != '0'):
+	enable(None if (_env == '1') else _env)